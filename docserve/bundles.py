@@ -0,0 +1,184 @@
+# docserve/bundles.py
+"""
+Build-once docs bundles, so one machine runs make_docs and every app node just
+imports the result (see the export_docs and import_docs commands).
+
+A bundle is a manifest of every file in the built site with its sha256. File
+contents are stored once per checksum, so exporting or importing a new version
+only moves the files that changed. The artifact store is a plain directory
+(DOCSERVE_ARTIFACT_STORE), eg. a shared mount or a directory synced to object
+storage:
+
+    {store}/objects/ab/abcdef...     file contents, named by sha256
+    {store}/bundles/{version}.json   manifests
+    {store}/LATEST                   version of the most recent export
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Optional
+
+from django.conf import settings
+
+from .utils import META_DIR, write_json_atomic
+
+# the manifest of the active bundle, kept inside the imported site
+BUNDLE_FILE = 'bundle.json'
+
+# build-host state that is never exported
+EXCLUDE = {
+    f'{META_DIR}/generate_cache.json',
+    f'{META_DIR}/{BUNDLE_FILE}',
+    f'{META_DIR}/build_history.jsonl',
+}
+EXCLUDE_DIRS = (
+    f'{META_DIR}/image_cache/',
+    f'{META_DIR}/profile/',
+    f'{META_DIR}/shards/',
+)
+
+
+class BundleError(Exception):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_site(site_dir: str) -> dict:
+    """
+    Return {relative posix path: {'sha256', 'size'}} for every file under site_dir.
+    """
+    files = {}
+    for root, dirs, names in os.walk(site_dir):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, site_dir).replace('\\', '/')
+            if rel in EXCLUDE or rel.startswith(EXCLUDE_DIRS) or name.endswith('.tmp'):
+                continue
+            files[rel] = {'sha256': file_sha256(path), 'size': os.path.getsize(path)}
+    return files
+
+
+class LocalArtifactStore:
+    """
+    An artifact store in a local (or mounted) directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = str(root)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def _manifest_path(self, version: str) -> str:
+        return os.path.join(self.root, 'bundles', f'{version}.json')
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self._object_path(digest))
+
+    def put(self, digest: str, src: str) -> None:
+        dest = self._object_path(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+    def fetch(self, digest: str, dest: str) -> None:
+        src = self._object_path(digest)
+        if not os.path.exists(src):
+            raise BundleError(f"Object {digest} is missing from the artifact store {self.root!r}.")
+        shutil.copyfile(src, dest)
+
+    def write_manifest(self, manifest: dict) -> None:
+        write_json_atomic(self._manifest_path(manifest['version']), manifest, indent=1)
+        tmp = os.path.join(self.root, f'LATEST.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(manifest['version'])
+        os.replace(tmp, os.path.join(self.root, 'LATEST'))
+
+    def read_manifest(self, version: str) -> dict:
+        try:
+            with open(self._manifest_path(version), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BundleError(f"Bundle version '{version}' not found in the artifact store {self.root!r}.")
+
+    def latest(self) -> str:
+        try:
+            with open(os.path.join(self.root, 'LATEST')) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            raise BundleError(f"No bundles have been exported to the artifact store {self.root!r}.")
+
+
+def get_store(path: str = None) -> LocalArtifactStore:
+    path = path or getattr(settings, 'DOCSERVE_ARTIFACT_STORE', None)
+    if not path:
+        raise BundleError("No artifact store given. Set DOCSERVE_ARTIFACT_STORE or pass --store.")
+    return LocalArtifactStore(path)
+
+
+def versions_dir(site_root: str) -> str:
+    """
+    Imported versions live beside the site root, which becomes a symlink to the active one.
+    """
+    return str(site_root).rstrip('/\\') + '.versions'
+
+
+def active_manifest(site_root: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(site_root, META_DIR, BUNDLE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def activate(site_root: str, target: str) -> Optional[str]:
+    """
+    Point site_root at target by atomically swapping a symlink. If site_root is
+    still a real directory (a site built in place) it is first moved into the
+    versions directory; returns where it went in that case.
+    """
+    site_root = str(site_root).rstrip('/\\')
+    moved = None
+    if os.path.isdir(site_root) and not os.path.islink(site_root):
+        moved = os.path.join(versions_dir(site_root), 'pre-import')
+        shutil.rmtree(moved, ignore_errors=True)
+        os.replace(site_root, moved)
+
+    tmp_link = f"{site_root}.{os.getpid()}.link"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, site_root)
+    return moved
+
+
+def prune_versions(site_root: str, keep: int) -> list:
+    """
+    Remove all but the `keep` most recently imported versions, never the active one.
+    """
+    root = versions_dir(site_root)
+    active = os.path.realpath(site_root)
+    candidates = [
+        os.path.join(root, d) for d in os.listdir(root)
+        if os.path.isdir(os.path.join(root, d)) and not d.endswith('.tmp')
+    ]
+    candidates = [d for d in candidates if os.path.realpath(d) != active]
+    candidates.sort(key=os.path.getmtime, reverse=True)
+
+    removed = []
+    # the active version counts towards keep
+    for path in candidates[max(keep - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(os.path.basename(path))
+    return removed
@@ -0,0 +1,133 @@
+# docserve/cache.py
+"""
+Optional shared cache for resolved docs lookups, using one of the project's Django
+CACHES (locmem, file based, redis...). Set
+
+    DOCSERVE_CACHE = 'default'   # alias in CACHES, None (the default) disables it
+
+Keys are namespaced by role and by the build version written by build_docs, a
+hash of the built files. Every worker on every node that serves the same build
+sees the same entries, and a rebuild that changes anything invalidates them all
+at once. Only what a request resolves to is cached, never role checks.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .bundles import scan_site
+from .utils import meta_dir, site_root, write_json_atomic
+
+BUILD_FILE = 'build.json'
+
+# cached misses need a value that isn't None
+MISSING = '__docserve_missing__'
+
+_version_lock = threading.Lock()
+_version_memo = {}  # build file path -> (mtime_ns, version)
+
+
+def docs_cache():
+    alias = getattr(settings, 'DOCSERVE_CACHE', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def _role_digest(role_dir: str) -> str:
+    # the sitemap only differs between identical builds by its <lastmod> dates
+    files = {rel: entry['sha256'] for rel, entry in scan_site(role_dir).items()
+             if rel not in ('sitemap.xml', 'sitemap.xml.gz')}
+    return hashlib.sha1(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def write_build_version(root: str = None, role: str = None) -> str:
+    """
+    Record the build version under the site root. It is derived from the content of
+    the built role sites, so every node that builds the same docs gets the same
+    version and shares cache entries. build_docs calls this after each role, passing
+    the role so only its files are hashed again.
+    """
+    root = str(root or site_root())
+    path = os.path.join(meta_dir(root), BUILD_FILE)
+    digests = {}
+    if role is not None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                digests = dict(json.load(f).get('roles') or {})
+        except (OSError, ValueError, AttributeError, TypeError):
+            digests = {}
+        roles = [role]
+    else:
+        roles = [
+            d for d in os.listdir(root)
+            if os.path.isdir(os.path.join(root, d)) and not d.startswith('.') and not d.endswith(('.tmp', '.old'))
+        ]
+
+    for name in roles:
+        role_dir = os.path.join(root, name)
+        if os.path.isdir(role_dir):
+            digests[name] = _role_digest(role_dir)
+        else:
+            digests.pop(name, None)
+
+    version = hashlib.sha1(json.dumps(digests, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    write_json_atomic(path, {'version': version, 'roles': digests})
+    return version
+
+
+def build_version(root: str = None) -> str:
+    """
+    The version of the docs currently on disk. Costs one stat per call; the file is
+    only re-read when it changes.
+    """
+    path = os.path.join(meta_dir(root), BUILD_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return '0'
+
+    with _version_lock:
+        memo = _version_memo.get(path)
+    if memo and memo[0] == mtime:
+        return memo[1]
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            version = str(json.load(f).get('version', '0'))
+    except (OSError, ValueError, AttributeError):
+        return '0'
+
+    with _version_lock:
+        _version_memo[path] = (mtime, version)
+    return version
+
+
+def make_key(role: str, kind: str, *parts) -> str:
+    # hash the variable part so keys stay short and memcached-safe whatever the path
+    digest = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+    return f"docserve:{build_version()}:{role}:{kind}:{digest}"
+
+
+def cached(role: str, kind: str, parts: tuple, compute):
+    """
+    Return compute() via the shared cache, if one is configured. None results are
+    cached too (as MISSING) so repeated misses don't hit the filesystem.
+    """
+    cache = docs_cache()
+    if cache is None:
+        return compute()
+
+    key = make_key(role, kind, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, MISSING if value is None else value,
+                  getattr(settings, 'DOCSERVE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        return value
+    return None if value == MISSING else value
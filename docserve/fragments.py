@@ -0,0 +1,243 @@
+# docserve/fragments.py
+"""
+Page fragments: the main article HTML, title and table of contents of each built
+page, extracted once by build_docs and stored as small JSON files so the app can
+embed help text without loading the full MkDocs shell.
+
+Fragments live outside the served role directories, under
+    {DOCSERVE_DOCS_SITE_ROOT}/.docserve/fragments/{role}/{page}.html.json
+
+Relative links and image urls in the article are made absolute (/docs/{role}/...)
+when the fragment is built, as the fragment is shown at some other URL.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import urljoin
+
+from .utils import meta_dir
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+_TAG = re.compile(r'<[a-zA-Z][^>]*>')
+_URL_ATTR = re.compile(r'(\s(?:href|src|poster)\s*=\s*)(["\'])(.*?)\2', re.IGNORECASE | re.DOTALL)
+_SRCSET_ATTR = re.compile(r'(\ssrcset\s*=\s*)(["\'])(.*?)\2', re.IGNORECASE | re.DOTALL)
+
+
+def fragments_dir(role: str, root: str = None) -> str:
+    return os.path.join(meta_dir(root), 'fragments', role)
+
+
+class _ArticleParser(HTMLParser):
+    """
+    Locate the first <article> (MkDocs Material wraps page content in
+    `<article class="md-content__inner md-typeset">`), falling back to <main> or
+    <body>, and record the headings inside it. Offsets into the raw source are
+    kept so the article markup is returned byte-for-byte rather than re-serialised.
+    """
+
+    CONTAINERS = ('article', 'main', 'body')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ''
+        self.spans = {}          # container tag -> (start, end) offsets of inner html
+        self._open = {}          # container tag -> (depth, inner start offset)
+        self._in_title = False
+        self._heading = None     # [level, id, text parts] while inside a heading
+        self._skip_depth = 0     # inside a headerlink anchor, whose text is "¶"
+        self.headings = []       # (offset, level, id, text)
+        self._line_starts = [0]
+
+    def feed_document(self, html: str) -> None:
+        pos = html.find('\n')
+        while pos != -1:
+            self._line_starts.append(pos + 1)
+            pos = html.find('\n', pos + 1)
+        self.feed(html)
+        self.close()
+
+    def _offset(self) -> int:
+        line, col = self.getpos()
+        return self._line_starts[line - 1] + col
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.CONTAINERS and tag not in self.spans:
+            depth, start = self._open.get(tag, (0, None))
+            if depth == 0:
+                start = self._offset() + len(self.get_starttag_text())
+            self._open[tag] = (depth + 1, start)
+        if tag == 'title':
+            self._in_title = True
+        elif tag in HEADING_TAGS and self._heading is None:
+            attrs = dict(attrs)
+            self._heading = [int(tag[1]), attrs.get('id'), [], self._offset()]
+        elif tag == 'a' and self._heading is not None:
+            if 'headerlink' in (dict(attrs).get('class') or '').split() or self._skip_depth:
+                self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self._open:
+            depth, start = self._open[tag]
+            depth -= 1
+            if depth == 0:
+                del self._open[tag]
+                self.spans[tag] = (start, self._offset())
+            else:
+                self._open[tag] = (depth, start)
+        if tag == 'title':
+            self._in_title = False
+        elif tag == 'a' and self._skip_depth:
+            self._skip_depth -= 1
+        elif self._heading is not None and tag == f'h{self._heading[0]}':
+            level, anchor, parts, offset = self._heading
+            text = ' '.join(''.join(parts).split())
+            self.headings.append((offset, level, anchor, text))
+            self._heading = None
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        if self._heading is not None and not self._skip_depth:
+            self._heading[2].append(data)
+
+
+def _absolute_url(url: str, page_url: str) -> str:
+    if not url or url.startswith(('#', '/', 'data:', 'mailto:', 'tel:', 'javascript:')) or '://' in url:
+        return url
+    return urljoin(page_url, url)
+
+
+def absolute_urls(html: str, page_url: str) -> str:
+    """
+    Resolve relative href/src/poster/srcset urls in html against page_url, the
+    absolute URL of the page it came from. In-page anchors are left alone.
+    """
+    def rewrite_srcset(match):
+        candidates = []
+        for candidate in match.group(3).split(','):
+            url, _, descriptor = candidate.strip().partition(' ')
+            candidates.append(f"{_absolute_url(url, page_url)} {descriptor}".strip())
+        return match.group(1) + match.group(2) + ', '.join(candidates) + match.group(2)
+
+    def rewrite_tag(match):
+        tag = _URL_ATTR.sub(
+            lambda m: m.group(1) + m.group(2) + _absolute_url(m.group(3), page_url) + m.group(2), match.group(0)
+        )
+        return _SRCSET_ATTR.sub(rewrite_srcset, tag)
+
+    return _TAG.sub(rewrite_tag, html)
+
+
+def extract_fragment(html: str, page_url: str = None) -> dict:
+    """
+    Return {'title', 'html', 'toc', 'etag'} for a built page. `toc` is a flat list
+    of {'level', 'id', 'title'} for every heading with an id inside the article.
+    If page_url is given, relative urls in the article html are made absolute.
+    """
+    parser = _ArticleParser()
+    parser.feed_document(html)
+
+    start, end = 0, len(html)
+    for tag in _ArticleParser.CONTAINERS:
+        if tag in parser.spans:
+            start, end = parser.spans[tag]
+            break
+    body = html[start:end].strip()
+    if page_url:
+        body = absolute_urls(body, page_url)
+
+    headings = [h for h in parser.headings if start <= h[0] < end]
+    toc = [
+        {'level': level, 'id': anchor, 'title': text}
+        for _, level, anchor, text in headings
+        if anchor
+    ]
+
+    # prefer the page's own h1 over <title>, which Material suffixes with the site name
+    h1 = next((text for _, level, _, text in headings if level == 1), None)
+    title = h1 or ' '.join(parser.title.split())
+
+    fragment = {'title': title, 'html': body, 'toc': toc}
+    digest = hashlib.sha1(json.dumps(fragment, sort_keys=True).encode('utf-8')).hexdigest()
+    fragment['etag'] = digest
+    return fragment
+
+
+def build_fragments(site_dir: str, dest_dir: str, base_url: str = None) -> int:
+    """
+    Extract a fragment for every .html page under site_dir (a built role site) into
+    dest_dir, replacing whatever was there. base_url is the URL the role is served
+    under (eg. /docs/user/), used to make urls in the fragments absolute. Returns
+    the number of pages written.
+    """
+    tmp_dir = dest_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    count = 0
+    for root, dirs, files in os.walk(site_dir):
+        # theme/search assets never contain pages
+        dirs[:] = [d for d in dirs if d not in ('assets', 'search')]
+        for f in files:
+            if not f.endswith('.html'):
+                continue
+            src = os.path.join(root, f)
+            rel = os.path.relpath(src, site_dir)
+            page = rel.replace('\\', '/')
+            page_url = urljoin(base_url, page) if base_url else None
+            with open(src, 'r', encoding='utf-8', errors='replace') as fh:
+                fragment = extract_fragment(fh.read(), page_url)
+            fragment['page'] = page
+
+            dest = os.path.join(tmp_dir, rel + '.json')
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, 'w', encoding='utf-8') as fh:
+                json.dump(fragment, fh)
+            count += 1
+
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    if os.path.exists(tmp_dir):
+        os.replace(tmp_dir, dest_dir)
+    return count
+
+
+def normalise_page(page: str) -> Optional[str]:
+    """
+    Map a page reference as used in links/DocServeMixin ('guide/add_entry',
+    'guide/add_entry.md', 'guide/', '') to the built .html path, or None if it
+    tries to escape the role directory.
+    """
+    page = (page or '').split('#', 1)[0].strip().lstrip('/')
+    if page == '' or page.endswith('/'):
+        page += 'index.html'
+    elif page.endswith('.md'):
+        page = page[:-3] + '.html'
+    elif not posixpath.splitext(page)[1]:
+        page += '.html'
+
+    page = posixpath.normpath(page)
+    if page.startswith('..') or page.startswith('/') or not page.endswith('.html'):
+        return None
+    return page
+
+
+def load_fragment(role: str, page: str) -> Optional[dict]:
+    """
+    Load the stored fragment for an already-normalised page, or None if the page
+    was not built.
+    """
+    path = os.path.join(fragments_dir(role), page + '.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        # a directory page: 'guide.html' may have been built as 'guide/index.html'
+        if not page.endswith('index.html'):
+            return load_fragment(role, page[:-len('.html')] + '/index.html')
+        return None
@@ -0,0 +1,316 @@
+# docserve/images.py
+"""
+Post-build image optimisation for build_docs. Needs Pillow (pip install Pillow);
+the stage is skipped with a warning if it is not installed.
+
+For every png/jpeg in a built role site this:
+  - recompresses the image in place (only if that makes it smaller), applying
+    any EXIF orientation and keeping the other EXIF data and colour profile
+  - writes next-gen variants beside it: name.png.webp, name.png.avif
+  - writes narrower copies for srcset: name@640w.png (+ .webp/.avif variants)
+  - adds srcset/sizes to <img> tags that point at it
+
+Animated images (APNG) are left as they are.
+
+The views serve name.png.avif/.webp in place of name.png when the browser's
+Accept header allows it. Results are cached by the image's content hash, so
+unchanged images are not reprocessed on the next build.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from .utils import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# best first: the order variants are offered to browsers in
+VARIANT_FORMATS = ('avif', 'webp')
+
+VARIANT_CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+_SAVE_OPTIONS = {
+    'PNG': {'optimize': True},
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'WEBP': {'quality': 80, 'method': 6},
+    'AVIF': {'quality': 60},
+}
+
+# bump when _process_image changes what it writes, so older cache entries are not reused
+_CACHE_VERSION = 2
+
+_IMG_TAG = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+_SRC_ATTR = re.compile(r'\ssrc\s*=\s*(["\'])(.*?)\1', re.IGNORECASE | re.DOTALL)
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def supported_formats(formats) -> list:
+    """
+    The requested variant formats this Pillow build can write (AVIF needs Pillow 11.3+
+    or pillow-avif-plugin).
+    """
+    from PIL import features
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    return [fmt for fmt in formats if fmt in VARIANT_FORMATS and features.check(fmt)]
+
+
+def _sized_name(name: str, width: int) -> str:
+    base, ext = os.path.splitext(name)
+    return f"{base}@{width}w{ext}"
+
+
+def _process_image(src: str, entry_dir: str, formats: list, widths: list) -> dict:
+    """
+    Produce every output for one image into entry_dir (a cache entry) and return
+    its metadata. Runs in a worker process, so it must not touch Django settings.
+    """
+    from PIL import Image, ImageOps
+
+    tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    ext = os.path.splitext(src)[1].lower()
+    image_format = 'PNG' if ext == '.png' else 'JPEG'
+    # outputs: {'file': name in the cache entry, 'width': resized width or None, 'format': variant or None}
+    outputs = []
+
+    try:
+        with Image.open(src) as opened:
+            if getattr(opened, 'is_animated', False):
+                # re-encoding would keep only the first frame, so leave animations untouched
+                meta = {'width': opened.width, 'height': opened.height, 'widths': [], 'outputs': []}
+                write_json_atomic(os.path.join(tmp_dir, 'meta.json'), meta)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_dir, entry_dir)
+                return meta
+
+            # apply the EXIF orientation to the pixels (and drop the tag), so every output
+            # displays the right way up, and carry the remaining EXIF and colour profile over
+            im = ImageOps.exif_transpose(opened)
+            im.load()
+            width, height = im.size
+            keep = {}
+            if opened.info.get('icc_profile'):
+                keep['icc_profile'] = opened.info['icc_profile']
+            exif = im.getexif()
+            if exif:
+                keep['exif'] = exif.tobytes()
+
+            # recompressed original, kept only if it beats what the author committed
+            optimized = os.path.join(tmp_dir, 'image' + ext)
+            im.save(optimized, image_format, **_SAVE_OPTIONS[image_format], **keep)
+            if os.path.getsize(optimized) < os.path.getsize(src):
+                outputs.append({'file': 'image' + ext, 'width': None, 'format': None})
+            else:
+                os.remove(optimized)
+
+            sizes = [(None, im)]
+            for w in sorted(set(widths)):
+                if w < width:
+                    resized = im.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+                    name = _sized_name('image' + ext, w)
+                    resized.save(os.path.join(tmp_dir, name), image_format, **_SAVE_OPTIONS[image_format], **keep)
+                    outputs.append({'file': name, 'width': w, 'format': None})
+                    sizes.append((w, resized))
+
+            for w, sized in sizes:
+                base = 'image' + ext if w is None else _sized_name('image' + ext, w)
+                if sized.mode in ('RGB', 'RGBA'):
+                    converted = sized
+                else:
+                    has_alpha = 'A' in sized.mode or 'transparency' in sized.info
+                    converted = sized.convert('RGBA' if has_alpha else 'RGB')
+                for fmt in formats:
+                    name = f"{base}.{fmt}"
+                    converted.save(os.path.join(tmp_dir, name), fmt.upper(), **_SAVE_OPTIONS[fmt.upper()], **keep)
+                    outputs.append({'file': name, 'width': w, 'format': fmt})
+
+        meta = {'width': width, 'height': height, 'widths': [w for w, _ in sizes if w], 'outputs': outputs}
+        write_json_atomic(os.path.join(tmp_dir, 'meta.json'), meta)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        return meta
+    finally:
+        # gone already if the entry was installed; left over if Pillow raised
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _content_hash(path: str, params: str) -> str:
+    digest = hashlib.sha256(params.encode('utf-8'))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _install(entry_dir: str, meta: dict, image_path: str) -> None:
+    """
+    Copy a cache entry's outputs next to the image in the built site.
+    """
+    directory, name = os.path.split(image_path)
+    for output in meta['outputs']:
+        dest_name = name if output['width'] is None else _sized_name(name, output['width'])
+        if output['format']:
+            dest_name += '.' + output['format']
+        dest = os.path.join(directory, dest_name)
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(os.path.join(entry_dir, output['file']), dest)
+        except OSError:
+            shutil.copyfile(os.path.join(entry_dir, output['file']), dest)
+
+
+def optimize_images(site_dir: str, cache_dir: str, formats=('webp', 'avif'), widths=(640, 1280), workers=None) -> dict:
+    """
+    Run the image stage over a built role site. Returns counts of images found,
+    processed, served from the cache and failed. An image Pillow can't process is
+    logged and left as it is, with no cache entry.
+    """
+    formats = supported_formats(formats)
+    params = json.dumps({
+        'version': _CACHE_VERSION, 'formats': sorted(formats), 'widths': sorted(set(widths)), 'options': _SAVE_OPTIONS,
+    }, sort_keys=True)
+
+    images = []
+    for root, dirs, files in os.walk(site_dir):
+        for f in files:
+            # skip variants left over from a previous stage run into the same dir
+            if f.lower().endswith(IMAGE_EXTENSIONS) and not re.search(r'@\d+w\.\w+$', f):
+                images.append(os.path.join(root, f))
+
+    todo = {}
+    entries = {}
+    for path in images:
+        key = _content_hash(path, params)
+        entry_dir = os.path.join(cache_dir, key[:2], key)
+        entries[path] = entry_dir
+        if not os.path.exists(os.path.join(entry_dir, 'meta.json')) and entry_dir not in todo:
+            todo[entry_dir] = path
+
+    # encoding is cpu bound, so use processes rather than threads
+    failed = set()
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_process_image, src, entry_dir, formats, list(widths)) for entry_dir, src in todo.items()]
+            for entry_dir, future in zip(todo, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    # eg. a corrupt or misnamed file, which mkdocs copies without complaint
+                    logger.warning(f"[images] Leaving {todo[entry_dir]} as it is: {e}")
+                    failed.add(entry_dir)
+
+    srcsets = {}
+    for path, entry_dir in entries.items():
+        if entry_dir in failed:
+            continue
+        with open(os.path.join(entry_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        _install(entry_dir, meta, path)
+        rel = os.path.relpath(path, site_dir).replace('\\', '/')
+        srcsets[rel] = meta
+
+    add_srcsets(site_dir, srcsets)
+    return {
+        'images': len(images), 'processed': len(todo) - len(failed),
+        'cached': len(set(entries.values())) - len(todo), 'failed': len(failed),
+    }
+
+
+def add_srcsets(site_dir: str, images: dict) -> None:
+    """
+    Give <img> tags pointing at a resized image a srcset/sizes so browsers can pick
+    a narrower copy. Tags that already have a srcset are left alone.
+    """
+    images = {rel: meta for rel, meta in images.items() if meta['widths']}
+    if not images:
+        return
+
+    for root, dirs, files in os.walk(site_dir):
+        for f in files:
+            if not f.endswith('.html'):
+                continue
+            page = os.path.join(root, f)
+            page_dir = posixpath.dirname(os.path.relpath(page, site_dir).replace('\\', '/'))
+
+            def rewrite(match):
+                tag = match.group(0)
+                src = _SRC_ATTR.search(tag)
+                if not src or 'srcset' in tag.lower():
+                    return tag
+                url = src.group(2)
+                if '://' in url or url.startswith(('/', 'data:')):
+                    return tag
+                meta = images.get(posixpath.normpath(posixpath.join(page_dir, url.split('?')[0].split('#')[0])))
+                if not meta:
+                    return tag
+                candidates = [f"{_sized_name(url, w)} {w}w" for w in meta['widths']]
+                candidates.append(f"{url} {meta['width']}w")
+                width = meta['width']
+                extra = f' srcset="{", ".join(candidates)}" sizes="(min-width: {width}px) {width}px, 100vw"'
+                end = -2 if tag.endswith('/>') else -1
+                return tag[:end].rstrip() + extra + tag[end:]
+
+            with open(page, 'r', encoding='utf-8') as fh:
+                html = fh.read()
+            new_html = _IMG_TAG.sub(rewrite, html)
+            if new_html != html:
+                with open(page, 'w', encoding='utf-8') as fh:
+                    fh.write(new_html)
+
+
+def image_variants(full_path: str) -> list:
+    """
+    The next-gen variants available for a built image, best first.
+    """
+    if not full_path.lower().endswith(IMAGE_EXTENSIONS):
+        return []
+    return [fmt for fmt in VARIANT_FORMATS if os.path.isfile(f"{full_path}.{fmt}")]
+
+
+def accepted_variant(request, variants: list) -> Optional[str]:
+    """
+    Pick the best variant the browser explicitly accepts. A bare */* is not enough:
+    browsers that can't decode avif/webp still send it.
+    """
+    if not variants:
+        return None
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT', '').split(','):
+        media_type, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(media_type.strip().lower())
+    for fmt in variants:
+        if VARIANT_CONTENT_TYPES[fmt] in accepted:
+            return fmt
+    return None
@@ -2,13 +2,31 @@
 
 import os
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
+from docserve.cache import write_build_version
+from docserve.fragments import build_fragments, fragments_dir
+from docserve.images import optimize_images, pillow_available
+from docserve.postprocess import DEFAULT_FINGERPRINT_EXCLUDE, postprocess_site
+from docserve.profiling import BuildProfile, children_cpu, dir_stats, mkdocs_stage_timings, summary_lines
+from docserve.shards import is_sharded, merge_shards, shard_config_files
+from docserve.utils import configured_site_url, meta_dir, site_url_prefix
+
 
 class Command(BaseCommand):
     help = 'Build MkDocs documentation for all roles.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='Record per-role timings, mkdocs stage timings and output sizes to a JSON report and the build history.',
+        )
+
     def handle(self, *args, **options):
         docs_root = getattr(settings, 'DOCSERVE_DOCS_ROOT', os.path.join(settings.BASE_DIR, 'docs'))
         output_root = getattr(settings, 'DOCSERVE_DOCS_SITE_ROOT', os.path.join(settings.BASE_DIR, 'docs_site'))
@@ -24,14 +42,55 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("No documentation to build."))
             return
 
-        for role in roles:
-            mkdocs_yml = os.path.join(docs_root, f'mkdocs_{role}.yml')
-            output_dir = os.path.join(output_root, role)
+        self.profile = BuildProfile('build_docs') if options.get('profile') else None
+
+        try:
+            for role in roles:
+                if self.profile is None:
+                    self.build_role(role, docs_root, output_root)
+                else:
+                    with self.profile.role(role) as record:
+                        self.build_role(role, docs_root, output_root, record=record)
+        finally:
+            # a failed deploy is the one most worth profiling, so save what was recorded
+            if self.profile is not None:
+                report, path, previous = self.profile.save(output_root)
+                self.stdout.write(self.style.NOTICE(f"Profile written to {path}"))
+                for line in summary_lines(report, previous):
+                    self.stdout.write(line)
+
+    def _timed(self, record, name):
+        """
+        Time a step into a role's profile record, or do nothing if not profiling.
+        """
+        if record is None:
+            return nullcontext()
+        return self.profile.timer(record, name)
+
+    def build_role(self, role, docs_root, output_root, record=None):
+        """
+        Build one role's site and run the post-build stages. record, when profiling,
+        collects the role's step timings, mkdocs stage timings and output size.
+        """
+        mkdocs_yml = os.path.join(docs_root, f'mkdocs_{role}.yml')
+        output_dir = os.path.join(output_root, role)
+
+        if not os.path.exists(mkdocs_yml):
+            self.stdout.write(self.style.WARNING(f"Configuration file '{mkdocs_yml}' not found. Generating..."))
+            subprocess.run(['python', 'manage.py', 'generate_mkdocs_yml'], check=True)
+        site_url = configured_site_url(docs_root, role)
 
-            if not os.path.exists(mkdocs_yml):
-                self.stdout.write(self.style.WARNING(f"Configuration file '{mkdocs_yml}' not found. Generating..."))
-                subprocess.run(['python', 'manage.py', 'generate_mkdocs_yml'], check=True)
+        shards = {}
+        if is_sharded(role, getattr(settings, 'DOCSERVE_SHARD_ROLES', [])):
+            shards = shard_config_files(docs_root, role)
+            if not shards:
+                self.stdout.write(self.style.WARNING(
+                    f"[shards] No shard configs for role '{role}'; run generate_mkdocs_yml. Building it as one site."
+                ))
 
+        if shards:
+            self.build_shards(role, shards, output_root, output_dir, record)
+        else:
             build_command = [
                 'mkdocs', 'build',
                 '--config-file', mkdocs_yml,
@@ -39,11 +98,136 @@ class Command(BaseCommand):
             ]
 
             self.stdout.write(f"Building documentation for role '{role}'...")
-            result = subprocess.run(build_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode != 0:
-                self.stderr.write(self.style.ERROR(f"Error building documentation for role '{role}':"))
-                self.stderr.write(result.stdout)
-                self.stderr.write(result.stderr)
-                raise CommandError(f"Failed to build documentation for role '{role}'.")
+            with self._timed(record, 'mkdocs'):
+                returncode, stdout, stderr = self.run_mkdocs(build_command, record)
+            if returncode != 0:
+                self.build_failed(role, output_root, stdout, stderr)
             else:
                 self.stdout.write(self.style.SUCCESS(f"Documentation for role '{role}' built successfully."))
+
+        if getattr(settings, 'DOCSERVE_OPTIMIZE_IMAGES', True):
+            with self._timed(record, 'images'):
+                self.optimize_images(role, output_dir, output_root)
+
+        # after images, so variants are renamed with their image, and before fragments, so they see the final urls
+        minify = getattr(settings, 'DOCSERVE_MINIFY_HTML', True)
+        fingerprint = getattr(settings, 'DOCSERVE_FINGERPRINT_ASSETS', True)
+        if minify or fingerprint:
+            with self._timed(record, 'postprocess'):
+                stats = postprocess_site(
+                    output_dir, minify=minify, fingerprint=fingerprint,
+                    exclude=getattr(settings, 'DOCSERVE_FINGERPRINT_EXCLUDE', DEFAULT_FINGERPRINT_EXCLUDE),
+                    workers=getattr(settings, 'DOCSERVE_BUILD_WORKERS', None),
+                    base_url=site_url,
+                )
+            self.stdout.write(
+                f"Post-processed {stats['pages']} page(s) for role '{role}': "
+                f"{stats['assets']} asset(s) fingerprinted, pages {stats['bytes_before']} -> {stats['bytes_after']} bytes."
+            )
+
+        # extract article/title/toc of each page once here so docs_fragments only reads small json files
+        if getattr(settings, 'DOCSERVE_BUILD_FRAGMENTS', True):
+            with self._timed(record, 'fragments'):
+                count = build_fragments(output_dir, fragments_dir(role, output_root), base_url=site_url_prefix(site_url, role))
+            self.stdout.write(f"Extracted {count} page fragment(s) for role '{role}'.")
+
+        # new version after every role, so even a partly failed build invalidates DOCSERVE_CACHE entries
+        write_build_version(output_root, role)
+
+        if record is not None:
+            record.update(dir_stats(output_dir))
+
+    def build_failed(self, role, output_root, stdout, stderr, shard=None):
+        label = f"role '{role}'" if shard is None else f"role '{role}' (shard '{shard}')"
+        self.stderr.write(self.style.ERROR(f"Error building documentation for {label}:"))
+        self.stderr.write(stdout)
+        self.stderr.write(stderr)
+        # mkdocs may have cleared the site dir already
+        write_build_version(output_root, role)
+        raise CommandError(f"Failed to build documentation for {label}.")
+
+    def build_shards(self, role, shards, output_root, output_dir, record=None):
+        """
+        Build a sharded role's sub-sites in parallel, then merge them into the role's
+        site directory so its URLs are unchanged.
+        """
+        shards_root = os.path.join(meta_dir(output_root), 'shards', role)
+        shard_dirs = {shard: os.path.join(shards_root, shard) for shard in sorted(shards)}
+        shard_records = {shard: ({} if record is not None else None) for shard in shards}
+
+        def build(shard):
+            command = ['mkdocs', 'build', '--config-file', shards[shard], '--site-dir', shard_dirs[shard]]
+            return self.run_mkdocs(command, shard_records[shard])
+
+        workers = getattr(settings, 'DOCSERVE_BUILD_WORKERS', None) or os.cpu_count() or 1
+        self.stdout.write(f"Building documentation for role '{role}' as {len(shards)} shard(s): {', '.join(sorted(shards))}...")
+        child_cpu = children_cpu()
+        with self._timed(record, 'mkdocs'):
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(shards)))) as pool:
+                results = dict(zip(shard_dirs, pool.map(build, shard_dirs)))
+
+        failed = [shard for shard, (returncode, _, _) in results.items() if returncode != 0]
+        if failed:
+            shard = failed[0]
+            _, stdout, stderr = results[shard]
+            self.build_failed(role, output_root, stdout, stderr, shard=shard)
+
+        with self._timed(record, 'merge'):
+            merge_shards(shard_dirs, output_dir)
+        self.stdout.write(self.style.SUCCESS(f"Documentation for role '{role}' built successfully."))
+
+        if record is not None:
+            # shards run concurrently, so only the total child cpu is meaningful
+            record['child_cpu'] = round(children_cpu() - child_cpu, 4)
+            record['shards'] = {
+                shard: {'mkdocs_stages': shard_record['mkdocs_stages'], **dir_stats(shard_dirs[shard])}
+                for shard, shard_record in shard_records.items()
+            }
+
+    def run_mkdocs(self, build_command, record=None):
+        """
+        Run mkdocs build, returning (returncode, stdout, stderr). When profiling, run
+        it verbosely and timestamp each line of output to time its stages.
+        """
+        if record is None:
+            result = subprocess.run(build_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            return result.returncode, result.stdout, result.stderr
+
+        child_cpu = children_cpu()
+        lines = []
+        proc = subprocess.Popen(build_command + ['--verbose'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        for line in proc.stdout:
+            lines.append((time.perf_counter(), line.rstrip('\n')))
+        proc.wait()
+
+        record['child_cpu'] = round(children_cpu() - child_cpu, 4)
+        record['mkdocs_stages'] = mkdocs_stage_timings(lines)
+        return proc.returncode, '\n'.join(line for _, line in lines), ''
+
+    def optimize_images(self, role, output_dir, output_root):
+        """
+        Recompress the role's images and add webp/avif variants and narrower copies,
+        reusing results for images whose content has not changed.
+        """
+        if not pillow_available():
+            self.stdout.write(self.style.WARNING(
+                "[images] Pillow not installed; skipping image optimisation. "
+                "Install it (pip install Pillow) or set DOCSERVE_OPTIMIZE_IMAGES = False."
+            ))
+            return
+
+        stats = optimize_images(
+            output_dir,
+            os.path.join(meta_dir(output_root), 'image_cache'),
+            formats=getattr(settings, 'DOCSERVE_IMAGE_FORMATS', ['webp', 'avif']),
+            widths=getattr(settings, 'DOCSERVE_IMAGE_WIDTHS', [640, 1280]),
+            workers=getattr(settings, 'DOCSERVE_BUILD_WORKERS', None),
+        )
+        self.stdout.write(
+            f"Optimised {stats['images']} image(s) for role '{role}': "
+            f"{stats['processed']} processed, {stats['cached']} unchanged."
+        )
+        if stats['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"[images] {stats['failed']} image(s) for role '{role}' could not be read by Pillow and were left as they are."
+            ))
@@ -0,0 +1,58 @@
+# docserve/management/commands/export_docs.py
+
+import os
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from docserve.bundles import BundleError, get_store, scan_site
+from docserve.cache import build_version
+from docserve.utils import site_root
+
+
+class Command(BaseCommand):
+    help = 'Package the built docs site into a versioned bundle in the artifact store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', help='Artifact store directory (default: DOCSERVE_ARTIFACT_STORE).')
+        parser.add_argument('--bundle-version',
+                            help='Bundle version (default: the version recorded by build_docs).')
+
+    def handle(self, *args, **options):
+        output_root = os.path.realpath(site_root())
+        if not os.path.isdir(output_root):
+            raise CommandError(f"The docs site directory '{output_root}' does not exist. Run build_docs first.")
+
+        try:
+            store = get_store(options.get('store'))
+        except BundleError as e:
+            raise CommandError(str(e))
+
+        version = options.get('bundle_version') or build_version(output_root)
+        if version == '0':
+            # site built before build versions were recorded
+            version = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+
+        files = scan_site(output_root)
+        if not files:
+            raise CommandError(f"The docs site directory '{output_root}' is empty. Run build_docs first.")
+
+        uploaded = 0
+        uploaded_bytes = 0
+        for rel, info in files.items():
+            if store.has(info['sha256']):
+                continue
+            store.put(info['sha256'], os.path.join(output_root, rel))
+            uploaded += 1
+            uploaded_bytes += info['size']
+
+        store.write_manifest({
+            'version': version,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'files': files,
+        })
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported docs version '{version}' to {store.root}: {len(files)} file(s), "
+            f"{uploaded} new ({uploaded_bytes} bytes)."
+        ))
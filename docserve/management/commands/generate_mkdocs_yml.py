@@ -1,12 +1,23 @@
 # docserve/management/commands/generate_mkdocs_yml.py
 
+import hashlib
+import json
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Optional
+
 import yaml
 from ruamel.yaml import YAML
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
+from docserve.profiling import BuildProfile, summary_lines
+from docserve.shards import is_sharded, shard_config_files, shard_config_path, shard_configs
+from docserve.utils import meta_dir, site_url_prefix, write_json_atomic
+
 # PyYAML serialises a Python callable as `!!python/name:module.func ''`, but
 # MkDocs' loader requires the python/name tag to carry an *empty* value and
 # rejects the trailing ''. This pattern strips it so the tag is valid YAML for
@@ -26,9 +37,27 @@ def _round_trip_yaml() -> YAML:
     return y
 
 
+# bump when the layout of the on-disk cache changes so old caches are discarded
+CACHE_VERSION = 1
+
+
 class Command(BaseCommand):
     help = 'Generate mkdocs.yml files for each top-level subdirectory in the docs directory.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of roles to process concurrently (default: DOCSERVE_BUILD_WORKERS or one per role, up to the cpu count).',
+        )
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Ignore the cached .pages/nav data and rescan every role.',
+        )
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='Record per-role timings to a JSON report and the build history.',
+        )
+
     def handle(self, *args, **options):
         #TODO: currently failes if overrides directory does not exist in docs
         '''
@@ -58,31 +87,218 @@ CommandError: Failed to build documentation for role 'judge'.
             self.stdout.write(self.style.WARNING("No subdirectories found in the docs directory."))
             return
 
-        for role in roles:
-            docs_dir = os.path.join(docs_root, role)
-            output_file = os.path.join(docs_root, f'mkdocs_{role}.yml')
-            site_name = f"{site_name_prefix}{role.capitalize()} Documentation"
-
-            if preserve_yml and os.path.exists(output_file):
-                added = self.append_missing_to_existing(output_file, docs_dir)
-                if added:
-                    self.stdout.write(self.style.SUCCESS(
-                        f"Updated {output_file} for role '{role}': appended {len(added)} new file(s)."
-                    ))
-                    for rel in added:
-                        self.stdout.write(self.style.WARNING(f"  + {rel}"))
-                else:
-                    self.stdout.write(self.style.SUCCESS(
-                        f"Preserved {output_file} for role '{role}': no new files to add."
-                    ))
-                continue
+        # parsed .pages files, navs and preserve-mode state from previous runs, keyed by path + mtime
+        cache_file = os.path.join(meta_dir(), 'generate_cache.json')
+        self._cache = self._read_cache(cache_file) if not options.get('no_cache') else self._empty_cache()
+        self._cache_lock = threading.Lock()
+
+        workers = options.get('workers') or getattr(settings, 'DOCSERVE_BUILD_WORKERS', None) or os.cpu_count() or 1
+        workers = max(1, min(workers, len(roles)))
 
-            nav = self.build_nav(docs_dir, role, rel_base='')
-            config = self.make_config(nav, site_name, role)
+        self.profile = BuildProfile('generate_mkdocs_yml') if options.get('profile') else None
+
+        def run(role):
+            if self.profile is None:
+                return self.generate_role(role, docs_root, site_name_prefix, preserve_yml)
+            with self.profile.role(role) as record:
+                self.generate_role(role, docs_root, site_name_prefix, preserve_yml, record=record)
+
+        try:
+            # roles are independent, so process them concurrently; result() re-raises any failure
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(run, role) for role in roles]
+                for future in futures:
+                    future.result()
+
+            # default=str: .pages may hold yaml dates etc., which only matter as labels
+            write_json_atomic(cache_file, self._cache, default=str)
+        finally:
+            if self.profile is not None:
+                report, path, previous = self.profile.save()
+                self.stdout.write(self.style.NOTICE(f"Profile written to {path}"))
+                for line in summary_lines(report, previous):
+                    self.stdout.write(line)
+
+    def _timed(self, record, name):
+        """
+        Time a step into a role's profile record, or do nothing if not profiling.
+        """
+        if record is None:
+            return nullcontext()
+        return self.profile.timer(record, name)
+
+    def generate_role(self, role: str, docs_root: str, site_name_prefix: str, preserve_yml: bool, record: dict = None) -> None:
+        """
+        Generate or update mkdocs_{role}.yml, plus its shard configs if the role is
+        listed in DOCSERVE_SHARD_ROLES. record, when profiling, collects the role's
+        step timings and file counts.
+        """
+        self.write_role_config(role, docs_root, site_name_prefix, preserve_yml, record)
 
+        if is_sharded(role, getattr(settings, 'DOCSERVE_SHARD_ROLES', [])):
+            with self._timed(record, 'shards'):
+                self.write_shard_configs(role, docs_root)
+        else:
+            # the role may have been sharded before
+            for path in shard_config_files(docs_root, role).values():
+                os.remove(path)
+
+    def write_role_config(self, role: str, docs_root: str, site_name_prefix: str, preserve_yml: bool, record: dict = None) -> None:
+        docs_dir = os.path.join(docs_root, role)
+        output_file = os.path.join(docs_root, f'mkdocs_{role}.yml')
+        site_name = f"{site_name_prefix}{role.capitalize()} Documentation"
+
+        if preserve_yml and os.path.exists(output_file):
+            with self._timed(record, 'scan'):
+                on_disk = self._scan_md_files(docs_dir)
+            if record is not None:
+                record['md_files'] = len(on_disk)
+            state = {
+                'md': hashlib.sha1('\n'.join(sorted(on_disk)).encode('utf-8')).hexdigest(),
+                'yml_mtime': os.stat(output_file).st_mtime_ns,
+            }
+            cache_key = os.path.abspath(output_file)
+            with self._cache_lock:
+                unchanged = self._cache['preserve'].get(cache_key) == state
+
+            if record is not None:
+                record['preserve_skipped'] = unchanged
+
+            if unchanged:
+                # same md files and nobody touched the yml since we last checked it: skip the ruamel round trip
+                self.stdout.write(self.style.SUCCESS(
+                    f"Preserved {output_file} for role '{role}': no new files to add."
+                ))
+                return
+
+            with self._timed(record, 'preserve'):
+                added = self.append_missing_to_existing(output_file, docs_dir, on_disk=on_disk)
+            if added is not None:
+                state['yml_mtime'] = os.stat(output_file).st_mtime_ns
+                with self._cache_lock:
+                    self._cache['preserve'][cache_key] = state
+
+            if added:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Updated {output_file} for role '{role}': appended {len(added)} new file(s)."
+                ))
+                for rel in added:
+                    self.stdout.write(self.style.WARNING(f"  + {rel}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Preserved {output_file} for role '{role}': no new files to add."
+                ))
+            return
+
+        with self._timed(record, 'nav'):
+            nav = self._cached_nav(docs_dir)
+            nav_cached = nav is not None
+            if nav is None:
+                nav = self.build_nav(docs_dir, role, rel_base='')
+                self._store_nav(docs_dir, nav)
+        if record is not None:
+            record['nav_cached'] = nav_cached
+            record['md_files'] = len(self._collect_referenced_md(nav))
+
+        config = self.make_config(nav, site_name, role)
+
+        with self._timed(record, 'write'):
             self._write_config(config, output_file)
 
-            self.stdout.write(self.style.SUCCESS(f"Generated {output_file} for role '{role}'."))
+        self.stdout.write(self.style.SUCCESS(f"Generated {output_file} for role '{role}'."))
+
+    # -------------------------
+    # SHARDS
+    # -------------------------
+
+    def write_shard_configs(self, role: str, docs_root: str) -> None:
+        """
+        Split mkdocs_{role}.yml into one config per top-level section (see
+        docserve.shards). Works from the yml on disk so hand-crafted navs in preserve
+        mode are sharded too. Skipped when the shard configs are newer than it.
+        """
+        output_file = os.path.join(docs_root, f'mkdocs_{role}.yml')
+        existing = shard_config_files(docs_root, role)
+        yml_mtime = self._mtime(output_file)
+        if yml_mtime is None:
+            return
+        if existing and all((self._mtime(path) or 0) >= yml_mtime for path in existing.values()):
+            return
+
+        ryaml = _round_trip_yaml()
+        with open(output_file, 'r', encoding='utf-8') as f:
+            config = ryaml.load(f) or {}
+
+        url_prefix = site_url_prefix(config.get('site_url'), role)
+        configs = shard_configs(config, os.path.join(docs_root, role), url_prefix)
+
+        for shard, path in existing.items():
+            if shard not in configs:
+                os.remove(path)
+
+        if not configs:
+            self.stdout.write(self.style.WARNING(
+                f"[shards] Role '{role}' has no top-level sections to shard by; it will be built as one site."
+            ))
+            return
+
+        for shard, shard_config in configs.items():
+            with open(shard_config_path(docs_root, role, shard), 'w') as f:
+                ryaml.dump(shard_config, f)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(configs)} shard config(s) for role '{role}': {', '.join(configs)}."
+        ))
+
+    # -------------------------
+    # CACHE
+    # -------------------------
+
+    def _empty_cache(self) -> dict:
+        return {'version': CACHE_VERSION, 'pages': {}, 'nav': {}, 'preserve': {}}
+
+    def _read_cache(self, cache_file: str) -> dict:
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return self._empty_cache()
+        if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+            return self._empty_cache()
+        return cache
+
+    def _mtime(self, path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _cached_nav(self, docs_dir: str) -> Optional[list]:
+        """
+        Return the nav built for docs_dir on a previous run if nothing it depends on
+        has changed. Adding, removing or renaming an entry changes its directory's
+        mtime, so stat-ing the recorded directories and .pages files is enough to
+        validate it without listing anything.
+        """
+        with self._cache_lock:
+            entry = self._cache['nav'].get(os.path.abspath(docs_dir))
+        if not entry:
+            return None
+        for path, mtime in entry['stamps'].items():
+            if self._mtime(path) != mtime:
+                return None
+        return entry['nav']
+
+    def _store_nav(self, docs_dir: str, nav: list) -> None:
+        stamps = {}
+        for root, dirs, files in os.walk(docs_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            stamps[os.path.abspath(root)] = self._mtime(root)
+            if '.pages' in files:
+                pages_path = os.path.abspath(os.path.join(root, '.pages'))
+                stamps[pages_path] = self._mtime(pages_path)
+        with self._cache_lock:
+            self._cache['nav'][os.path.abspath(docs_dir)] = {'stamps': stamps, 'nav': nav}
 
     # -------------------------
     # NAV BUILDING
@@ -225,12 +441,13 @@ CommandError: Failed to build documentation for role 'judge'.
     # PRESERVE / APPEND-ONLY MODE
     # -------------------------
 
-    def append_missing_to_existing(self, output_file: str, docs_dir: str) -> list:
+    def append_missing_to_existing(self, output_file: str, docs_dir: str, on_disk: list = None) -> Optional[list]:
         """
         Load an existing mkdocs_{role}.yml, leave it otherwise untouched, and append
         any markdown files under docs_dir that are not already referenced in its nav
         to the bottom of the top-level nav list. Returns the list of relative paths
-        appended (empty if nothing changed).
+        appended (empty if nothing changed), or None if the file could not be used.
+        on_disk may be passed if the caller has already scanned docs_dir.
         """
         ryaml = _round_trip_yaml()
         try:
@@ -240,7 +457,7 @@ CommandError: Failed to build documentation for role 'judge'.
             self.stdout.write(self.style.WARNING(
                 f"[preserve] Failed to parse {output_file!r}, regenerating instead: {e}"
             ))
-            return []
+            return None
 
         if config is None:
             config = {}
@@ -249,7 +466,7 @@ CommandError: Failed to build documentation for role 'judge'.
             self.stdout.write(self.style.WARNING(
                 f"[preserve] {output_file!r} is not a mapping, skipping."
             ))
-            return []
+            return None
 
         nav = config.get('nav')
         if not isinstance(nav, list):
@@ -257,7 +474,8 @@ CommandError: Failed to build documentation for role 'judge'.
             config['nav'] = nav
 
         referenced = self._collect_referenced_md(nav)
-        on_disk = self._scan_md_files(docs_dir)
+        if on_disk is None:
+            on_disk = self._scan_md_files(docs_dir)
 
         missing = [rel for rel in on_disk if rel not in referenced]
         # index.md first, then alphabetical, so appended order is predictable
@@ -332,25 +550,38 @@ CommandError: Failed to build documentation for role 'judge'.
     def _default_section_title(self, dirname: str) -> str:
         return dirname.replace('_', ' ').replace('-', ' ').title()
 
-    def _load_pages(self, dir_abs: str) -> dict | None:
+    def _load_pages(self, dir_abs: str) -> Optional[dict]:
         """
         Load and return .pages YAML dict if present; otherwise None.
         We only care about the 'nav' key, but we ignore silently if missing.
         """
-        pages_path = os.path.join(dir_abs, '.pages')
-        if not os.path.exists(pages_path):
+        pages_path = os.path.abspath(os.path.join(dir_abs, '.pages'))
+        mtime = self._mtime(pages_path)
+        if mtime is None:
             return None
+
+        cache = getattr(self, '_cache', None)
+        if cache is not None:
+            with self._cache_lock:
+                cached = cache['pages'].get(pages_path)
+            if cached and cached['mtime'] == mtime:
+                return cached['data']
+
         try:
             with open(pages_path, 'r', encoding='utf-8') as f:
                 data = yaml.safe_load(f) or {}
                 if not isinstance(data, dict):
                     self.stdout.write(self.style.WARNING(f"[.pages] Ignoring non-dict config in {pages_path!r}"))
                     return None
-                return data
         except Exception as e:
             self.stdout.write(self.style.WARNING(f"[.pages] Failed to parse {pages_path!r}: {e}"))
             return None
 
+        if cache is not None:
+            with self._cache_lock:
+                cache['pages'][pages_path] = {'mtime': mtime, 'data': data}
+        return data
+
     # -------------------------
     # CONFIG
     # -------------------------
@@ -0,0 +1,96 @@
+# docserve/management/commands/import_docs.py
+
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from docserve.bundles import (
+    BUNDLE_FILE, BundleError, activate, active_manifest, file_sha256, get_store, prune_versions, versions_dir,
+)
+from docserve.utils import META_DIR, site_root, write_json_atomic
+
+
+class Command(BaseCommand):
+    help = 'Verify a docs bundle from the artifact store and atomically make it the live docs site.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bundle_version', nargs='?', help='Version to import (default: the latest export).')
+        parser.add_argument('--store', help='Artifact store directory (default: DOCSERVE_ARTIFACT_STORE).')
+        parser.add_argument('--keep', type=int, default=3, help='Number of imported versions to keep on disk (default: 3).')
+        parser.add_argument('--force', action='store_true', help='Import even if this version is already active.')
+
+    def handle(self, *args, **options):
+        root = site_root()
+        try:
+            store = get_store(options.get('store'))
+            version = options.get('bundle_version') or store.latest()
+            manifest = store.read_manifest(version)
+        except BundleError as e:
+            raise CommandError(str(e))
+
+        current = active_manifest(root) or {}
+        if current.get('version') == version and not options['force']:
+            self.stdout.write(self.style.SUCCESS(f"Docs version '{version}' is already active."))
+            return
+
+        current_dir = os.path.realpath(root)
+        current_files = current.get('files', {})
+
+        # a fresh directory for every import, so re-importing the active version (--force)
+        # never touches the directory that is live until the symlink has moved off it
+        os.makedirs(versions_dir(root), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f"{version}.", suffix='.tmp', dir=versions_dir(root))
+        target = staging[:-len('.tmp')]
+        # mkdtemp makes it private to this user; the web server needs to read it
+        os.chmod(staging, 0o755)
+
+        reused = fetched = fetched_bytes = 0
+        try:
+            for rel, info in manifest['files'].items():
+                dest = os.path.join(staging, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+                local = os.path.join(current_dir, rel)
+                # the active manifest may be stale (eg. after a build_docs into the live
+                # version), so check the local copy itself; it's a local read, not a transfer
+                if (current_files.get(rel, {}).get('sha256') == info['sha256'] and os.path.isfile(local)
+                        and file_sha256(local) == info['sha256']):
+                    # unchanged since the active version: link it rather than transferring it again
+                    try:
+                        os.link(local, dest)
+                    except OSError:
+                        shutil.copyfile(local, dest)
+                    reused += 1
+                    continue
+
+                store.fetch(info['sha256'], dest)
+                if file_sha256(dest) != info['sha256']:
+                    raise BundleError(f"Checksum mismatch for '{rel}' in docs version '{version}'.")
+                fetched += 1
+                fetched_bytes += info['size']
+
+            write_json_atomic(os.path.join(staging, META_DIR, BUNDLE_FILE), manifest)
+        except (BundleError, OSError) as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise CommandError(f"Failed to import docs version '{version}': {e}")
+
+        os.replace(staging, target)
+
+        moved = activate(root, target)
+        if current.get('version') == version and os.path.dirname(current_dir) == os.path.realpath(versions_dir(root)):
+            # the previous copy of this version is no longer live
+            shutil.rmtree(current_dir, ignore_errors=True)
+        if moved:
+            self.stdout.write(self.style.WARNING(
+                f"Moved the existing docs site directory to {moved}; {root} is now a symlink to the active version."
+            ))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Activated docs version '{version}': {len(manifest['files'])} file(s), "
+            f"{reused} unchanged, {fetched} fetched ({fetched_bytes} bytes)."
+        ))
+
+        for removed in prune_versions(root, options['keep']):
+            self.stdout.write(f"Removed old docs version '{removed}'.")
@@ -11,11 +11,17 @@ class Command(BaseCommand):
     help = 'Generate mkdocs.yml files for each top-level subdirectory in the docs directory.'
 
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='Profile both steps (see generate_mkdocs_yml --profile and build_docs --profile).',
+        )
+
     def handle(self, *args, **options):
             self.stdout.write(self.style.NOTICE("Starting generate_mkdocs_yml..."))
-            call_command("generate_mkdocs_yml")
+            call_command("generate_mkdocs_yml", profile=options['profile'])
 
             self.stdout.write(self.style.NOTICE("Starting build_docs..."))
-            call_command("build_docs")
+            call_command("build_docs", profile=options['profile'])
 
             self.stdout.write(self.style.SUCCESS("All tasks completed successfully!"))
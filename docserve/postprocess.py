@@ -0,0 +1,262 @@
+# docserve/postprocess.py
+"""
+Post-build HTML minification and asset fingerprinting for build_docs.
+
+Fingerprinting renames each file under a role's assets/ directory to include a
+hash of its content (assets/images/favicon.png -> assets/images/favicon.1a2b3c4d.png)
+and rewrites the references to it in every page and stylesheet. Image variants
+from the image stage (favicon.png.webp) are renamed with their image so format
+negotiation keeps working. Files whose names already carry a hash, such as
+Material's main.ec1eaa64.min.css, keep them. serve_docs_asset only marks
+fingerprinted files as immutable.
+
+Minification collapses runs of whitespace and drops comments outside <pre>,
+<textarea>, <script> and <style>.
+
+Pages are processed in chunks cut at tag boundaries, so memory use does not
+grow with page size or the number of pages.
+"""
+
+import fnmatch
+import os
+import posixpath
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .bundles import file_sha256
+from .images import IMAGE_EXTENSIONS, VARIANT_FORMATS
+
+# lunr language support is loaded by the search worker from computed paths
+DEFAULT_FINGERPRINT_EXCLUDE = ['assets/javascripts/lunr/*']
+
+_CHUNK = 64 * 1024
+
+_FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}\.[^/]+$')
+
+# a url reaching into assets/: anything before it is kept, the assets/ part is looked up
+_ASSET_REF = re.compile(r'(?P<prefix>[^\s"\'()<>,=\\]*?)(?P<asset>assets/[^\s"\'()<>,?#\\]+)')
+
+_CSS_URL = re.compile(r'url\(\s*(["\']?)(?P<url>[^"\')\s]+)\1\s*\)', re.IGNORECASE)
+
+_MINIFY_TOKEN = re.compile(
+    r'(?P<comment><!--(?!\[if).*?-->)|<(?P<name>pre|textarea|script|style)\b[^>]*>',
+    re.IGNORECASE | re.DOTALL,
+)
+_WHITESPACE = re.compile(r'[ \t\r\n\f]+')
+
+
+def is_fingerprinted(path: str) -> bool:
+    return bool(_FINGERPRINTED.search(path.replace('\\', '/').rsplit('/', 1)[-1]))
+
+
+def _fingerprinted_name(rel: str, digest: str) -> str:
+    base, ext = posixpath.splitext(rel)
+    return f"{base}.{digest[:8]}{ext}"
+
+
+def rewrite_refs(text: str, base_dir: str, renames: dict, base_url: Optional[str] = None) -> str:
+    """
+    Point references to renamed assets at their new names. base_dir is the
+    directory (relative to the site root) relative urls in text resolve from.
+    base_url is the role's site_url (eg. https://example.org/docs/user/); absolute
+    urls are only rewritten when they point into it, and never without it.
+    """
+    site = urlsplit(base_url or '')
+    base_path = site.path if site.path.endswith('/') else site.path + '/'
+
+    def replace(match):
+        prefix, asset = match.group('prefix'), match.group('asset')
+        new = renames.get(asset)
+        if new is None:
+            return match.group(0)
+        path = prefix + asset
+        if '://' in prefix or prefix.startswith('//'):
+            # eg. a cdn or another site with its own assets/
+            parts = urlsplit(path)
+            if not site.netloc or parts.netloc != site.netloc:
+                return match.group(0)
+            path = parts.path
+        if path.startswith('/'):
+            # another role's assets (/docs/admin/assets/...) have their own names
+            if not base_url or posixpath.normpath(path) != base_path + asset:
+                return match.group(0)
+        elif posixpath.normpath(posixpath.join(base_dir, path)) != asset:
+            # a relative url must really resolve to the root assets/, not eg. guide/assets/
+            return match.group(0)
+        return prefix + new
+
+    return _ASSET_REF.sub(replace, text)
+
+
+def rewrite_css_urls(css: str, css_dir: str, renames: dict) -> str:
+    """
+    Rewrite relative url(...) references in a stylesheet under css_dir, which
+    usually don't mention assets/ (eg. url(../fonts/icons.woff2)).
+    """
+    def replace(match):
+        url = match.group('url')
+        if url.startswith(('/', 'data:')) or '://' in url:
+            return match.group(0)
+        end = min((i for i in (url.find('?'), url.find('#')) if i >= 0), default=len(url))
+        path, suffix = url[:end], url[end:]
+        new = renames.get(posixpath.normpath(posixpath.join(css_dir, path)))
+        if new is None:
+            return match.group(0)
+        new_url = posixpath.join(posixpath.dirname(path), posixpath.basename(new)) + suffix
+        return match.group(0).replace(url, new_url)
+
+    return _CSS_URL.sub(replace, css)
+
+
+def _collapse(text: str) -> str:
+    return _WHITESPACE.sub(lambda m: '\n' if '\n' in m.group(0) else ' ', text)
+
+
+def minify_html(text: str, raw: Optional[str] = None) -> tuple:
+    """
+    Minify a piece of html. raw is the element (pre, script...) the piece starts
+    inside of, if any. Returns (minified html, raw element at the end of the piece)
+    so consecutive pieces of one page can be minified separately.
+    """
+    out = []
+    pos = 0
+    while pos < len(text):
+        if raw:
+            close = re.compile(rf'</{raw}\s*>', re.IGNORECASE).search(text, pos)
+            if close is None:
+                out.append(text[pos:])
+                break
+            out.append(text[pos:close.end()])
+            pos = close.end()
+            raw = None
+            continue
+        match = _MINIFY_TOKEN.search(text, pos)
+        if match is None:
+            out.append(_collapse(text[pos:]))
+            break
+        out.append(_collapse(text[pos:match.start()]))
+        if match.group('comment') is None:
+            out.append(match.group(0))
+            raw = match.group('name').lower()
+        pos = match.end()
+    return ''.join(out), raw
+
+
+def _cut_point(buf: str) -> int:
+    """
+    Where to split buf so the first part ends on a tag boundary outside a comment.
+    """
+    cut = buf.rfind('>') + 1
+    comment = buf.rfind('<!--', 0, cut)
+    if comment > buf.rfind('-->', 0, cut):
+        cut = comment
+    return cut
+
+
+def process_page(path: str, page_dir: str, renames: dict, minify: bool, base_url: Optional[str] = None) -> tuple:
+    """
+    Rewrite asset references in (and optionally minify) one html file in place,
+    streaming it in chunks. Returns (bytes before, bytes after).
+    """
+    before = os.path.getsize(path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    raw = None
+    carry = ''
+    with open(path, 'r', encoding='utf-8', newline='') as src, open(tmp, 'w', encoding='utf-8', newline='') as dest:
+        while True:
+            chunk = src.read(_CHUNK)
+            buf = carry + chunk
+            cut = _cut_point(buf) if chunk else len(buf)
+            part, carry = buf[:cut], buf[cut:]
+            if renames:
+                part = rewrite_refs(part, page_dir, renames, base_url)
+            if minify:
+                part, raw = minify_html(part, raw)
+            dest.write(part)
+            if not chunk:
+                break
+    os.replace(tmp, path)
+    return before, os.path.getsize(path)
+
+
+def _process_page_args(args):
+    return process_page(*args)
+
+
+def fingerprint_assets(site_dir: str, exclude=DEFAULT_FINGERPRINT_EXCLUDE, base_url: Optional[str] = None) -> dict:
+    """
+    Rename the files under site_dir/assets to content-hashed names. Returns
+    {old path: new path}, relative to site_dir, including image variants.
+    """
+    assets_dir = os.path.join(site_dir, 'assets')
+    files = set()
+    for root, dirs, names in os.walk(assets_dir):
+        for name in names:
+            files.add(os.path.relpath(os.path.join(root, name), site_dir).replace('\\', '/'))
+
+    # name.png.webp follows name.png rather than getting its own hash
+    variants = {}
+    variant_files = set()
+    for rel in files:
+        base, ext = posixpath.splitext(rel)
+        if ext[1:] in VARIANT_FORMATS and base in files and base.lower().endswith(IMAGE_EXTENSIONS):
+            variants.setdefault(base, []).append(ext)
+            variant_files.add(rel)
+
+    candidates = [
+        rel for rel in files
+        if rel not in variant_files and not any(fnmatch.fnmatch(rel, pattern) for pattern in exclude or [])
+    ]
+
+    renames = {}
+    # stylesheets last, as they may refer to fonts and images renamed before them
+    for rel in sorted(candidates, key=lambda rel: (rel.endswith('.css'), rel)):
+        path = os.path.join(site_dir, rel)
+        changed = False
+        if rel.endswith('.css'):
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                css = f.read()
+            css_dir = posixpath.dirname(rel)
+            rewritten = rewrite_refs(rewrite_css_urls(css, css_dir, renames), css_dir, renames, base_url)
+            if rewritten != css:
+                with open(path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(rewritten)
+                changed = True
+        # already hashed by the theme, and not changed by a rewrite here
+        if is_fingerprinted(rel) and not changed:
+            continue
+        renames[rel] = _fingerprinted_name(rel, file_sha256(path))
+
+    for old, new in list(renames.items()):
+        os.replace(os.path.join(site_dir, old), os.path.join(site_dir, new))
+        for ext in variants.get(old, []):
+            os.replace(os.path.join(site_dir, old + ext), os.path.join(site_dir, new + ext))
+            renames[old + ext] = new + ext
+    return renames
+
+
+def postprocess_site(site_dir: str, minify: bool = True, fingerprint: bool = True,
+                     exclude=DEFAULT_FINGERPRINT_EXCLUDE, workers=None, base_url: Optional[str] = None) -> dict:
+    """
+    Run the stage over a built role site whose site_url is base_url. Returns
+    counts of pages, renamed assets and the total page size before and after.
+    """
+    renames = fingerprint_assets(site_dir, exclude, base_url) if fingerprint else {}
+
+    pages = []
+    for root, dirs, files in os.walk(site_dir):
+        for name in files:
+            if name.endswith('.html'):
+                path = os.path.join(root, name)
+                page_dir = posixpath.dirname(os.path.relpath(path, site_dir).replace('\\', '/'))
+                pages.append((path, page_dir, renames, minify, base_url))
+
+    before = after = 0
+    if pages and (renames or minify):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for page_before, page_after in pool.map(_process_page_args, pages, chunksize=32):
+                before += page_before
+                after += page_after
+    return {'pages': len(pages), 'assets': len(renames), 'bytes_before': before, 'bytes_after': after}
@@ -0,0 +1,203 @@
+# docserve/profiling.py
+"""
+Build profiling for `--profile` on generate_mkdocs_yml, build_docs and make_docs.
+
+Each profiled run writes a JSON report to
+    {DOCSERVE_DOCS_SITE_ROOT}/.docserve/profile/{command}-{timestamp}.json
+and appends the same report as one line to DOCSERVE_BUILD_HISTORY (default
+.docserve/build_history.jsonl) so runs can be compared over time.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from .utils import meta_dir, write_json_atomic
+
+_PLUGIN_EVENT = re.compile(r"Running `(\w+)` event from plugin '([^']+)'")
+_BUILT_IN = re.compile(r"Documentation built in ([\d.]+) seconds")
+
+# prefixes of mkdocs --verbose messages that start a build stage
+_MKDOCS_STAGES = (
+    ('Cleaning site directory', 'clean'),
+    ('Reading', 'read_pages'),
+    ('Building page', 'build_pages'),
+    ('Building theme template', 'theme_templates'),
+    ('Copying static assets', 'copy_static'),
+)
+
+_LOG_PREFIX = re.compile(r'^\s*(DEBUG|INFO|WARNING|ERROR)\s*-\s*')
+
+
+def history_file(root: str = None) -> str:
+    return str(getattr(settings, 'DOCSERVE_BUILD_HISTORY', None) or os.path.join(meta_dir(root), 'build_history.jsonl'))
+
+
+def dir_stats(path: str) -> dict:
+    files = size = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+            files += 1
+    return {'files': files, 'bytes': size}
+
+
+def children_cpu() -> float:
+    """
+    CPU time used by finished child processes (eg. mkdocs build) so far.
+    """
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def mkdocs_stage_timings(lines: list) -> dict:
+    """
+    Turn timestamped `mkdocs build --verbose` output [(seconds, line), ...] into
+    seconds per stage. Each line is charged the time until the next line, so the
+    figures are approximate but show where a build spends its time, including
+    each plugin event ("plugin search.on_post_build").
+    """
+    stages = {}
+    stage = 'startup'
+    for i, (stamp, line) in enumerate(lines):
+        message = _LOG_PREFIX.sub('', line)
+        event = _PLUGIN_EVENT.search(message)
+        if event:
+            stage = f"plugin {event.group(2)}.on_{event.group(1)}"
+        else:
+            for prefix, name in _MKDOCS_STAGES:
+                if message.startswith(prefix):
+                    stage = name
+                    break
+        built = _BUILT_IN.search(message)
+        if built:
+            stages['reported_total'] = float(built.group(1))
+        if i + 1 < len(lines):
+            stages[stage] = round(stages.get(stage, 0.0) + lines[i + 1][0] - stamp, 4)
+    return stages
+
+
+class BuildProfile:
+    """
+    Collects per-role timings for one command run. Thread safe, so roles processed
+    concurrently can record into the same profile.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.started = datetime.now(timezone.utc)
+        self.roles = {}
+        self._lock = threading.Lock()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children_cpu = children_cpu()
+
+    @contextmanager
+    def role(self, role: str):
+        """
+        Time a role's work in the current thread. Yields a dict the caller can add
+        counts and sub-timings to. A role that raises is recorded with failed: True.
+        """
+        record = {}
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+        except BaseException:
+            record['failed'] = True
+            raise
+        finally:
+            record['wall'] = round(time.perf_counter() - wall, 4)
+            # child_cpu: time used by subprocesses such as mkdocs build, recorded by the caller
+            record['cpu'] = round(time.thread_time() - cpu + record.get('child_cpu', 0.0), 4)
+            with self._lock:
+                self.roles[role] = record
+
+    @contextmanager
+    def timer(self, record: dict, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record[name] = round(record.get(name, 0.0) + time.perf_counter() - start, 4)
+
+    def report(self) -> dict:
+        return {
+            'command': self.command,
+            'started': self.started.isoformat(),
+            'wall': round(time.perf_counter() - self._wall, 4),
+            'cpu': round(time.process_time() - self._cpu + children_cpu() - self._children_cpu, 4),
+            'roles': dict(sorted(self.roles.items())),
+        }
+
+    def save(self, root: str = None) -> tuple:
+        """
+        Write the report and append it to the history file. Returns (report, report
+        path, previous report for the same command from the history, or None).
+        """
+        report = self.report()
+        # microseconds, so two runs in the same second don't share a report
+        stamp = self.started.strftime('%Y%m%dT%H%M%S.%f')
+        path = os.path.join(meta_dir(root), 'profile', f'{self.command}-{stamp}.json')
+        write_json_atomic(path, report, indent=2)
+
+        history = history_file(root)
+        previous = None
+        try:
+            with open(history, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('command') == self.command:
+                        previous = entry
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(history), exist_ok=True)
+        with open(history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(report) + '\n')
+        return report, path, previous
+
+
+def summary_lines(report: dict, previous: dict = None) -> list:
+    """
+    One line per role (slowest first) plus a total, with the change since the
+    previous run of the same command when there is one.
+    """
+    def change(now, before):
+        if not before:
+            return ''
+        return f" ({(now - before) / before * 100:+.0f}%)"
+
+    before_roles = (previous or {}).get('roles', {})
+    lines = []
+    for role, record in sorted(report['roles'].items(), key=lambda item: -item[1]['wall']):
+        before = before_roles.get(role, {}).get('wall')
+        extra = ''.join(
+            f", {key} {record[key]}" for key in ('files', 'bytes', 'md_files') if key in record
+        )
+        if record.get('failed'):
+            extra += ', FAILED'
+        lines.append(f"  {role}: {record['wall']:.2f}s wall{change(record['wall'], before)}, {record['cpu']:.2f}s cpu{extra}")
+    lines.append(
+        f"  total: {report['wall']:.2f}s wall{change(report['wall'], (previous or {}).get('wall'))}, {report['cpu']:.2f}s cpu"
+    )
+    return lines
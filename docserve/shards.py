@@ -0,0 +1,204 @@
+# docserve/shards.py
+"""
+Section-sharded builds for very large roles (DOCSERVE_SHARD_ROLES).
+
+MkDocs embeds the whole nav in every page, so a role's build time and output grow
+roughly with pages x nav size. A sharded role is split into one sub-site per
+top-level nav section, plus a `_root` sub-site for everything else:
+
+- generate_mkdocs_yml writes mkdocs_{role}__{shard}.yml beside mkdocs_{role}.yml.
+  Each shard keeps its own section in full and has one link to the start of every
+  other section, which serves as the cross-section index. `exclude_docs` limits
+  it to its own pages.
+- build_docs builds the shards in parallel and merges them into the role's usual
+  site directory, combining their search indexes and sitemaps.
+
+Every page keeps the URL it would have had unsharded, so serve_docs serves
+sharded roles under the same /docs/{role}/ URLs with no routing changes.
+"""
+
+import glob
+import gzip
+import json
+import os
+import re
+import shutil
+
+ROOT_SHARD = '_root'
+
+_SITEMAP_URL = re.compile(r'<url>.*?</url>', re.DOTALL)
+
+
+def is_sharded(role: str, shard_roles) -> bool:
+    return shard_roles == '__all__' or role in (shard_roles or [])
+
+
+def shard_config_path(docs_root: str, role: str, shard: str) -> str:
+    return os.path.join(docs_root, f'mkdocs_{role}__{shard}.yml')
+
+
+def shard_config_files(docs_root: str, role: str) -> dict:
+    """
+    {shard name: config path} for a role's generated shard configs.
+    """
+    prefix = f'mkdocs_{role}__'
+    found = {}
+    for path in glob.glob(os.path.join(glob.escape(str(docs_root)), f'{prefix}*.yml')):
+        found[os.path.basename(path)[len(prefix):-len('.yml')]] = path
+    return found
+
+
+def _md_paths(node) -> list:
+    if isinstance(node, str):
+        return [node] if node.lower().endswith('.md') else []
+    if isinstance(node, list):
+        return [p for item in node for p in _md_paths(item)]
+    if isinstance(node, dict):
+        return [p for value in node.values() for p in _md_paths(value)]
+    return []
+
+
+def split_nav(nav: list, docs_dir: str) -> list:
+    """
+    Assign each top-level nav entry to a shard. Returns [(shard, entry), ...] in nav
+    order. A section becomes its own shard when every page in it lives under one
+    top-level directory, which names the shard. Anything else belongs to ROOT_SHARD.
+    """
+    assigned = []
+    used = set()
+    for entry in nav:
+        shard = ROOT_SHARD
+        if isinstance(entry, dict) and len(entry) == 1:
+            value = next(iter(entry.values()))
+            paths = [p.replace('\\', '/') for p in _md_paths(value)]
+            tops = {p.split('/', 1)[0] for p in paths}
+            if (isinstance(value, list) and paths and len(tops) == 1 and all('/' in p for p in paths)):
+                top = tops.pop()
+                if top not in used and top != ROOT_SHARD and os.path.isdir(os.path.join(docs_dir, top)):
+                    shard = top
+                    used.add(top)
+        assigned.append((shard, entry))
+    return assigned
+
+
+def shard_configs(config: dict, docs_dir: str, url_prefix: str) -> dict:
+    """
+    Derive {shard: config} from a role's full mkdocs config. url_prefix is the
+    path the role is served under (eg. /docs/user/) and is used for links to
+    other shards.
+    """
+    assigned = split_nav(list(config.get('nav') or []), docs_dir)
+    shards = []
+    for shard, _ in assigned:
+        if shard not in shards:
+            shards.append(shard)
+    sections = [s for s in shards if s != ROOT_SHARD]
+    if not sections:
+        return {}
+    if ROOT_SHARD not in shards:
+        # the root shard also carries the theme assets, search and 404 page
+        shards.insert(0, ROOT_SHARD)
+
+    existing = config.get('exclude_docs') or ''
+
+    result = {}
+    for shard in shards:
+        nav = []
+        for owner, entry in assigned:
+            if owner == shard:
+                nav.append(entry)
+                continue
+            # cross-section index: one link to the start of the other shard's entry
+            paths = _md_paths(entry)
+            if not paths:
+                continue
+            title = next(iter(entry)) if isinstance(entry, dict) else os.path.splitext(os.path.basename(entry))[0]
+            nav.append({title: url_prefix + paths[0][:-3] + '.html'})
+
+        if shard == ROOT_SHARD:
+            patterns = [f'/{section}/' for section in sections]
+        else:
+            patterns = ['/*', f'!/{shard}/']
+
+        shard_config = dict(config)
+        shard_config['nav'] = nav
+        shard_config['exclude_docs'] = '\n'.join(filter(None, [existing.strip()] + patterns)) + '\n'
+        result[shard] = shard_config
+    return result
+
+
+def _owned(rel: str, shard: str, sections: list) -> bool:
+    top = rel.split('/', 1)[0]
+    if shard == ROOT_SHARD:
+        return top not in sections
+    return top == shard and '/' in rel
+
+
+def merge_shards(shard_dirs: dict, dest: str) -> None:
+    """
+    Combine shard build outputs ({shard: built site dir}) into dest, replacing it.
+    The root shard supplies everything outside the section directories, each
+    section shard supplies its own directory, and the search indexes and sitemaps
+    are merged. Files are hard-linked where possible.
+    """
+    sections = [s for s in shard_dirs if s != ROOT_SHARD]
+    tmp = f"{dest.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    search = None
+    sitemap_urls = []
+    for shard, site_dir in shard_dirs.items():
+        for root, dirs, files in os.walk(site_dir):
+            for name in files:
+                src = os.path.join(root, name)
+                rel = os.path.relpath(src, site_dir).replace('\\', '/')
+                if rel == 'search/search_index.json':
+                    with open(src, 'r', encoding='utf-8') as f:
+                        index = json.load(f)
+                    if search is None:
+                        search = index
+                    else:
+                        search['docs'].extend(index.get('docs', []))
+                    continue
+                if rel == 'sitemap.xml':
+                    with open(src, 'r', encoding='utf-8') as f:
+                        sitemap_urls.extend(_SITEMAP_URL.findall(f.read()))
+                    continue
+                if rel == 'sitemap.xml.gz' or not _owned(rel, shard, sections):
+                    continue
+                dest_path = os.path.join(tmp, rel)
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                try:
+                    os.link(src, dest_path)
+                except OSError:
+                    shutil.copyfile(src, dest_path)
+
+    if search is not None:
+        seen = set()
+        docs = []
+        for doc in search['docs']:
+            if doc.get('location') not in seen:
+                seen.add(doc.get('location'))
+                docs.append(doc)
+        search['docs'] = docs
+        os.makedirs(os.path.join(tmp, 'search'), exist_ok=True)
+        with open(os.path.join(tmp, 'search', 'search_index.json'), 'w', encoding='utf-8') as f:
+            json.dump(search, f, separators=(',', ':'))
+
+    if sitemap_urls:
+        sitemap = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+            + '\n'.join(f'    {url}' for url in dict.fromkeys(sitemap_urls))
+            + '\n</urlset>\n'
+        )
+        with open(os.path.join(tmp, 'sitemap.xml'), 'w', encoding='utf-8') as f:
+            f.write(sitemap)
+        with gzip.open(os.path.join(tmp, 'sitemap.xml.gz'), 'wt', encoding='utf-8') as f:
+            f.write(sitemap)
+
+    old = f"{dest.rstrip(os.sep)}.{os.getpid()}.old"
+    if os.path.exists(dest):
+        os.replace(dest, old)
+    os.replace(tmp, dest)
+    shutil.rmtree(old, ignore_errors=True)
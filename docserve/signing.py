@@ -0,0 +1,196 @@
+# docserve/signing.py
+"""
+Signed access tokens, so a static server or CDN can deliver role-protected docs
+without every request going through Django.
+
+With DOCSERVE_SIGNED_ACCESS = True, serve_docs checks the role as usual and then
+sets a short-lived cookie scoped to that role's URL prefix (eg. /docs/user/).
+The cookie holds an HMAC-signed token:
+
+    {expires}.{base64 url prefix}.{signature}
+
+The same token can also be passed as ?docserve_token=... (see signed_url). Anything
+that knows the signing key can check a token from the request path, cookie and
+query string alone, with no database or session access:
+
+    - SignedDocsMiddleware wraps a WSGI app such as a static file server
+    - the docs_auth view answers nginx `auth_request` subrequests
+
+The token functions and the middleware only use the standard library, so they can
+run outside Django by passing the key explicitly.
+"""
+
+import base64
+import hashlib
+import hmac
+import time
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+from django.conf import settings
+
+from .utils import role_url
+
+TOKEN_NAME = 'docserve_token'
+
+_SALT = b'docserve.signing'
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _signature(key, prefix: str, expires: int) -> str:
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    message = f"{prefix}\n{expires}".encode('utf-8')
+    return _b64encode(hmac.new(_SALT + key, message, hashlib.sha256).digest())
+
+
+def make_token(key, prefix: str, expires: int) -> str:
+    """
+    A token for every path under prefix (which should end in /), valid until the
+    unix time expires.
+    """
+    return f"{int(expires)}.{_b64encode(prefix.encode('utf-8'))}.{_signature(key, prefix, int(expires))}"
+
+
+def token_expiry(key, token: str, path: str, now: float = None) -> Optional[int]:
+    """
+    The expiry time of token if it is genuine, unexpired and covers path (an
+    unquoted URL path), otherwise None.
+    """
+    try:
+        expires, prefix, signature = token.split('.')
+        expires = int(expires)
+        prefix = _b64decode(prefix).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if expires < (time.time() if now is None else now):
+        return None
+    if not hmac.compare_digest(signature, _signature(key, prefix, expires)):
+        return None
+    # the prefix has to be a whole directory, and .. must not climb out of it
+    if not prefix.endswith('/') or not path.startswith(prefix) or '..' in path.split('/'):
+        return None
+    return expires
+
+
+def cookie_values(cookie_header: str, name: str = TOKEN_NAME) -> list:
+    """
+    Every value of the named cookie. A browser holding tokens for several roles
+    sends one cookie per role.
+    """
+    values = []
+    for part in (cookie_header or '').split(';'):
+        cookie_name, _, value = part.strip().partition('=')
+        if cookie_name == name and value:
+            values.append(value.strip('"'))
+    return values
+
+
+def request_tokens(query_string: str, cookie_header: str, name: str = TOKEN_NAME) -> list:
+    return parse_qs(query_string or '').get(name, []) + cookie_values(cookie_header, name)
+
+
+def verify(key, path: str, query_string: str = '', cookie_header: str = '', name: str = TOKEN_NAME) -> bool:
+    """
+    Whether any token in the query string or cookies grants access to path.
+    """
+    return any(token_expiry(key, token, path) for token in request_tokens(query_string, cookie_header, name))
+
+
+class SignedDocsMiddleware:
+    """
+    WSGI middleware that only lets requests under `protect` (default /docs/)
+    through to app if they carry a valid token. Others go to fallback, eg. the
+    Django application, which checks the role and issues a fresh cookie, or are
+    refused with 403 if there is no fallback:
+
+        application = SignedDocsMiddleware(static_files_app, key, fallback=django_app)
+    """
+
+    def __init__(self, app, key, protect: str = '/docs/', fallback=None, name: str = TOKEN_NAME):
+        self.app = app
+        self.key = key
+        self.protect = protect
+        self.fallback = fallback
+        self.name = name
+
+    def __call__(self, environ, start_response):
+        # PEP 3333 paths are latin-1 decoded bytes
+        path = (environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')).encode('latin-1').decode('utf-8', 'replace')
+        if not path.startswith(self.protect):
+            return self.app(environ, start_response)
+        if verify(self.key, path, environ.get('QUERY_STRING', ''), environ.get('HTTP_COOKIE', ''), self.name):
+            return self.app(environ, start_response)
+        if self.fallback is not None:
+            return self.fallback(environ, start_response)
+        start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+        return [b'You do not have access to this documentation.']
+
+
+# -------------------------
+# DJANGO SIDE
+# -------------------------
+
+def signed_access_enabled() -> bool:
+    return bool(getattr(settings, 'DOCSERVE_SIGNED_ACCESS', False))
+
+
+def signing_key() -> str:
+    return getattr(settings, 'DOCSERVE_SIGNING_KEY', None) or settings.SECRET_KEY
+
+
+def token_ttl() -> int:
+    return int(getattr(settings, 'DOCSERVE_SIGNED_TTL', 600))
+
+
+def role_prefix(role: str) -> str:
+    return role_url(role)
+
+
+def issue_token(role: str) -> str:
+    return make_token(signing_key(), role_prefix(role), int(time.time()) + token_ttl())
+
+
+def signed_url(role: str, path: str = '') -> str:
+    """
+    URL of a page or file in a role's docs carrying its own token, for clients
+    that can't hold the cookie.
+    """
+    return f"{role_prefix(role)}{path.lstrip('/')}?{urlencode({TOKEN_NAME: issue_token(role)})}"
+
+
+def verify_uri(uri: str, cookie_header: str = '') -> bool:
+    """
+    Check a raw request URI (path and query string), eg. nginx's $request_uri.
+    """
+    parts = urlsplit(uri)
+    return verify(signing_key(), unquote(parts.path), parts.query, cookie_header)
+
+
+def set_access_cookie(request, response, role: str) -> None:
+    """
+    Give the browser a token for the role's URL prefix, unless the one it sent is
+    good for at least another half of DOCSERVE_SIGNED_TTL.
+    """
+    prefix = role_prefix(role)
+    key = signing_key()
+    ttl = token_ttl()
+    now = time.time()
+    for token in cookie_values(request.META.get('HTTP_COOKIE', '')):
+        expires = token_expiry(key, token, prefix, now)
+        if expires and expires - now > ttl / 2:
+            return
+
+    response.set_cookie(
+        TOKEN_NAME, make_token(key, prefix, int(now) + ttl),
+        max_age=ttl, path=prefix,
+        domain=getattr(settings, 'DOCSERVE_SIGNED_COOKIE_DOMAIN', None),
+        secure=request.is_secure(), httponly=True, samesite='Lax',
+    )
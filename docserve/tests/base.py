@@ -0,0 +1,44 @@
+# docserve/tests/base.py
+
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+
+class DocsSiteTestCase(TestCase):
+    """
+    A temporary built docs site (DOCSERVE_DOCS_SITE_ROOT) with the `user` role
+    directory at self.site_dir and a logged-in user. Subclasses add settings with
+    `settings_overrides` and build pages with write().
+    """
+
+    settings_overrides = {
+        'DOCSERVE_ROLE_DEFINITIONS': {'user': lambda user: True, 'admin': lambda user: False},
+    }
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site_dir = os.path.join(self.temp_dir, 'user')
+        os.makedirs(self.site_dir)
+
+        self.user = User.objects.create_user('reader', password='pw')
+        self.client.force_login(self.user)
+        self.settings_override = self.settings(DOCSERVE_DOCS_SITE_ROOT=self.temp_dir, **self.settings_overrides)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, rel, content, role='user'):
+        path = os.path.join(self.temp_dir, role, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+
+    def read(self, rel, role='user'):
+        with open(os.path.join(self.temp_dir, role, rel)) as f:
+            return f.read()
@@ -0,0 +1,101 @@
+# docserve/tests/test_bundles.py
+
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from docserve.bundles import LocalArtifactStore
+
+
+class ExportImportDocsTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.build_root = os.path.join(self.temp_dir, 'build_site')
+        self.node_root = os.path.join(self.temp_dir, 'node', 'docs_site')
+        self.store = os.path.join(self.temp_dir, 'store')
+        os.makedirs(os.path.join(self.build_root, 'user', 'assets'))
+        os.makedirs(os.path.dirname(self.node_root))
+        self.write('user/index.html', '<h1>Home</h1>')
+        self.write('user/assets/main.css', 'body {}')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, rel, content):
+        with open(os.path.join(self.build_root, rel), 'w') as f:
+            f.write(content)
+
+    def export(self, version):
+        with self.settings(DOCSERVE_DOCS_SITE_ROOT=self.build_root):
+            call_command('export_docs', store=self.store, bundle_version=version, stdout=StringIO())
+
+    def import_(self, *args):
+        out = StringIO()
+        with self.settings(DOCSERVE_DOCS_SITE_ROOT=self.node_root):
+            call_command('import_docs', *args, store=self.store, stdout=out)
+        return out.getvalue()
+
+    def read_node(self, rel):
+        with open(os.path.join(self.node_root, rel)) as f:
+            return f.read()
+
+    def test_export_import_incremental(self):
+        self.export('v1')
+        output = self.import_()
+        self.assertIn("Activated docs version 'v1'", output)
+        self.assertTrue(os.path.islink(self.node_root))
+        self.assertEqual(self.read_node('user/index.html'), '<h1>Home</h1>')
+
+        self.write('user/index.html', '<h1>New Home</h1>')
+        self.export('v2')
+        output = self.import_()
+        self.assertIn("1 unchanged, 1 fetched", output)
+        self.assertEqual(self.read_node('user/index.html'), '<h1>New Home</h1>')
+        self.assertEqual(self.read_node('user/assets/main.css'), 'body {}')
+
+        self.assertIn("already active", self.import_('v2'))
+
+    def test_force_reimport_of_active_version(self):
+        self.export('v1')
+        self.import_()
+        live = os.path.realpath(self.node_root)
+
+        output = self.import_('v1', '--force')
+        self.assertIn("Activated docs version 'v1'", output)
+        # staged beside the live copy and swapped in, then the old copy is removed
+        self.assertNotEqual(os.path.realpath(self.node_root), live)
+        self.assertFalse(os.path.exists(live))
+        self.assertEqual(self.read_node('user/index.html'), '<h1>Home</h1>')
+
+        # roll back to an earlier version
+        self.import_('v1')
+        self.assertEqual(self.read_node('user/index.html'), '<h1>Home</h1>')
+
+    def test_changed_live_file_not_reused(self):
+        self.export('v1')
+        self.import_()
+        # eg. build_docs run on the node: same size, different content, stale manifest
+        with open(os.path.join(self.node_root, 'user', 'assets', 'main.css'), 'w') as f:
+            f.write('body []')
+
+        self.write('user/index.html', '<h1>New Home</h1>')
+        self.export('v2')
+        output = self.import_()
+        self.assertIn("0 unchanged, 2 fetched", output)
+        self.assertEqual(self.read_node('user/assets/main.css'), 'body {}')
+
+    def test_corrupt_object_rejected(self):
+        self.export('v1')
+        store = LocalArtifactStore(self.store)
+        digest = store.read_manifest('v1')['files']['user/index.html']['sha256']
+        with open(store._object_path(digest), 'w') as f:
+            f.write('tampered')
+
+        with self.assertRaises(CommandError) as cm:
+            self.import_()
+        self.assertIn("Checksum mismatch for 'user/index.html'", str(cm.exception))
+        self.assertFalse(os.path.exists(self.node_root))
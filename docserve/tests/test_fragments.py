@@ -0,0 +1,110 @@
+# docserve/tests/test_fragments.py
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from docserve.fragments import build_fragments, extract_fragment, fragments_dir, normalise_page
+from docserve.tests.base import DocsSiteTestCase
+from docserve.utils import configured_site_url, site_url_prefix
+
+
+PAGE = '''<!doctype html>
+<html>
+<head><title>Add Entry - User Documentation</title></head>
+<body>
+<nav class="md-nav">lots of nav</nav>
+<main class="md-main">
+<article class="md-content__inner md-typeset">
+<h1 id="add-entry">Add Entry<a class="headerlink" href="#add-entry" title="Permanent link">&para;</a></h1>
+<p>Fill in the <em>form</em> &amp; save.</p>
+<p><img src="../assets/images/form.png" srcset="../assets/images/form@640w.png 640w, ../assets/images/form.png 1280w"></p>
+<p>See <a href="faqs.html#saving">saving</a>, <a href="#options">options</a> and <a href="https://example.com/x">elsewhere</a>.</p>
+<h2 id="options">Options<a class="headerlink" href="#options" title="Permanent link">&para;</a></h2>
+<p>More.</p>
+</article>
+</main>
+</body>
+</html>
+'''
+
+
+class ExtractFragmentTest(TestCase):
+    def test_extract_fragment(self):
+        fragment = extract_fragment(PAGE)
+
+        self.assertEqual(fragment['title'], 'Add Entry')
+        self.assertTrue(fragment['html'].startswith('<h1 id="add-entry">'))
+        self.assertIn('<p>Fill in the <em>form</em> &amp; save.</p>', fragment['html'])
+        self.assertNotIn('md-nav', fragment['html'])
+        self.assertNotIn('</article>', fragment['html'])
+        self.assertEqual(fragment['toc'], [
+            {'level': 1, 'id': 'add-entry', 'title': 'Add Entry'},
+            {'level': 2, 'id': 'options', 'title': 'Options'},
+        ])
+
+    def test_normalise_page(self):
+        self.assertEqual(normalise_page(''), 'index.html')
+        self.assertEqual(normalise_page('guide/'), 'guide/index.html')
+        self.assertEqual(normalise_page('/guide/add_entry'), 'guide/add_entry.html')
+        self.assertEqual(normalise_page('guide/add_entry.md#options'), 'guide/add_entry.html')
+        self.assertIsNone(normalise_page('../admin/index'))
+
+    def test_base_url_from_mkdocs_yml(self):
+        # build_docs takes the role's url from its config, not the URLconf
+        docs_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, docs_root)
+        with open(os.path.join(docs_root, 'mkdocs_user.yml'), 'w') as f:
+            f.write(
+                "site_url: https://example.org/help/user\n"
+                "markdown_extensions:\n"
+                "  - pymdownx.superfences:\n"
+                "      custom_fences:\n"
+                "        - name: mermaid\n"
+                "          format: !!python/name:pymdownx.superfences.fence_code_format\n"
+            )
+        self.assertEqual(site_url_prefix(configured_site_url(docs_root, 'user'), 'user'), '/help/user/')
+        self.assertEqual(site_url_prefix(configured_site_url(docs_root, 'admin'), 'admin'), '/docs/admin/')
+
+
+class DocsFragmentsViewTest(DocsSiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('index.html', '<html><body><article><h1 id="welcome">Welcome</h1></article></body></html>')
+        self.write('guide/add_entry.html', PAGE)
+        build_fragments(self.site_dir, fragments_dir('user', self.temp_dir), base_url='/docs/user/')
+
+    def test_batch_fetch(self):
+        response = self.client.get('/docs/user/_fragments/', {'page': ['', 'guide/add_entry', 'nope']})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['pages']['']['title'], 'Welcome')
+        self.assertEqual(data['pages']['guide/add_entry']['page'], 'guide/add_entry.html')
+        self.assertEqual(data['missing'], ['nope'])
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_urls_made_absolute(self):
+        response = self.client.get('/docs/user/_fragments/', {'page': 'guide/add_entry'})
+        html = response.json()['pages']['guide/add_entry']['html']
+        self.assertIn('<img src="/docs/user/assets/images/form.png" '
+                      'srcset="/docs/user/assets/images/form@640w.png 640w, /docs/user/assets/images/form.png 1280w">', html)
+        self.assertIn('<a href="/docs/user/guide/faqs.html#saving">', html)
+        self.assertIn('<a href="#options">', html)
+        self.assertIn('<a href="https://example.com/x">', html)
+        self.assertIn('<a class="headerlink" href="#add-entry"', html)
+
+    def test_etag_not_modified(self):
+        response = self.client.get('/docs/user/_fragments/', {'page': 'guide/add_entry'})
+        etag = response['ETag']
+        response = self.client.get('/docs/user/_fragments/', {'page': 'guide/add_entry'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_role_check(self):
+        response = self.client.get('/docs/admin/_fragments/', {'page': 'index'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_not_found(self):
+        response = self.client.get('/docs/user/_fragments/', {'page': '../admin/index'})
+        self.assertEqual(response.status_code, 404)
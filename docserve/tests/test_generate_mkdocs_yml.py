@@ -3,12 +3,17 @@
 import os
 import shutil
 import tempfile
+from io import StringIO
+from unittest.mock import patch
+
 import yaml
 
 from django.core.management import call_command, CommandError
 from django.test import TestCase, override_settings
 from django.conf import settings
 
+from docserve.management.commands.generate_mkdocs_yml import Command
+
 
 class GenerateMkdocsYmlCommandTest(TestCase):
     def setUp(self):
@@ -92,3 +97,65 @@ class GenerateMkdocsYmlCommandTest(TestCase):
             call_command('generate_mkdocs_yml', stdout=out)
             output = out.getvalue()
             self.assertIn("No subdirectories found in the docs directory.", output)
+
+
+class GenerateMkdocsYmlCacheTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.docs_root = os.path.join(self.temp_dir, 'docs')
+        self.role_dir = os.path.join(self.docs_root, 'user')
+        os.makedirs(os.path.join(self.role_dir, 'guide'))
+        for rel in ('index.md', 'guide/intro.md', 'guide/setup.md'):
+            with open(os.path.join(self.role_dir, rel), 'w') as f:
+                f.write('# Page\n')
+        with open(os.path.join(self.role_dir, 'guide', '.pages'), 'w') as f:
+            f.write('nav:\n  - setup.md\n  - intro.md\n')
+        self.settings_override = self.settings(
+            DOCSERVE_DOCS_ROOT=self.docs_root,
+            DOCSERVE_DOCS_SITE_ROOT=os.path.join(self.temp_dir, 'docs_site'),
+            DOCSERVE_ENABLE_MERMAID=False,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.temp_dir)
+
+    def load_nav(self):
+        with open(os.path.join(self.docs_root, 'mkdocs_user.yml')) as f:
+            return yaml.safe_load(f)['nav']
+
+    def test_nav_cached_until_directory_changes(self):
+        expected_nav = [
+            {'Index': 'index.md'},
+            {'Guide': [{'Setup': 'guide/setup.md'}, {'Intro': 'guide/intro.md'}]},
+        ]
+        with self.settings(DOCSERVE_PRESERVE_YML=False):
+            call_command('generate_mkdocs_yml', stdout=StringIO())
+            self.assertEqual(self.load_nav(), expected_nav)
+
+            with patch.object(Command, 'build_nav', side_effect=AssertionError('nav should be cached')):
+                call_command('generate_mkdocs_yml', stdout=StringIO())
+            self.assertEqual(self.load_nav(), expected_nav)
+
+            # a new file changes the directory mtime, so the nav is rebuilt
+            with open(os.path.join(self.role_dir, 'guide', 'zebra.md'), 'w') as f:
+                f.write('# Zebra\n')
+            call_command('generate_mkdocs_yml', stdout=StringIO())
+            self.assertEqual(self.load_nav()[1]['Guide'][-1], {'Zebra': 'guide/zebra.md'})
+
+    def test_preserve_skips_round_trip_when_unchanged(self):
+        call_command('generate_mkdocs_yml', stdout=StringIO())
+        call_command('generate_mkdocs_yml', stdout=StringIO())
+
+        with patch.object(Command, 'append_missing_to_existing', side_effect=AssertionError('should be skipped')):
+            out = StringIO()
+            call_command('generate_mkdocs_yml', stdout=out)
+        self.assertIn("no new files to add", out.getvalue())
+
+        with open(os.path.join(self.role_dir, 'faqs.md'), 'w') as f:
+            f.write('# FAQs\n')
+        out = StringIO()
+        call_command('generate_mkdocs_yml', stdout=out)
+        self.assertIn("appended 1 new file(s)", out.getvalue())
+        self.assertEqual(self.load_nav()[-1], {'Faqs': 'faqs.md'})
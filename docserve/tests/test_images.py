@@ -0,0 +1,122 @@
+# docserve/tests/test_images.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.test import TestCase, RequestFactory
+
+from docserve.images import accepted_variant, optimize_images, pillow_available
+
+
+class AcceptedVariantTest(TestCase):
+    def accept(self, header, variants=('avif', 'webp')):
+        request = RequestFactory().get('/', HTTP_ACCEPT=header)
+        return accepted_variant(request, list(variants))
+
+    def test_accepted_variant(self):
+        self.assertEqual(self.accept('image/avif,image/webp,image/apng,*/*;q=0.8'), 'avif')
+        self.assertEqual(self.accept('image/webp,*/*'), 'webp')
+        self.assertEqual(self.accept('image/avif;q=0,image/webp'), 'webp')
+        self.assertIsNone(self.accept('*/*'))
+        self.assertIsNone(self.accept('image/avif', variants=['webp']))
+
+
+@unittest.skipUnless(pillow_available(), "Pillow is not installed")
+class OptimizeImagesTest(TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.site_dir = os.path.join(self.temp_dir, 'user')
+        self.cache_dir = os.path.join(self.temp_dir, 'image_cache')
+        os.makedirs(os.path.join(self.site_dir, 'guide'))
+        self.save_original = lambda: Image.new('RGB', (1000, 500), (200, 30, 30)).save(
+            os.path.join(self.site_dir, 'guide', 'shot.png'))
+        self.save_original()
+        with open(os.path.join(self.site_dir, 'guide', 'page.html'), 'w') as f:
+            f.write('<p><img alt="shot" src="shot.png" /></p>')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_variants_and_cache(self):
+        stats = optimize_images(self.site_dir, self.cache_dir, formats=['webp'], widths=[400, 2000], workers=1)
+        self.assertEqual(stats, {'images': 1, 'processed': 1, 'cached': 0, 'failed': 0})
+
+        guide = os.path.join(self.site_dir, 'guide')
+        for name in ('shot.png.webp', 'shot@400w.png', 'shot@400w.png.webp'):
+            self.assertTrue(os.path.exists(os.path.join(guide, name)), name)
+        self.assertFalse(os.path.exists(os.path.join(guide, 'shot@2000w.png')))
+
+        with open(os.path.join(guide, 'page.html')) as f:
+            html = f.read()
+        self.assertIn('srcset="shot@400w.png 400w, shot.png 1000w"', html)
+
+        # mkdocs copies the same original again on the next build: reuse the cache entry
+        os.remove(os.path.join(guide, 'shot.png.webp'))
+        self.save_original()
+        stats = optimize_images(self.site_dir, self.cache_dir, formats=['webp'], widths=[400, 2000], workers=1)
+        self.assertEqual(stats['processed'], 0)
+        self.assertTrue(os.path.exists(os.path.join(guide, 'shot.png.webp')))
+
+    def test_invalid_image_left_alone(self):
+        broken = os.path.join(self.site_dir, 'guide', 'broken.png')
+        with open(broken, 'wb') as f:
+            f.write(b'not really a png')
+
+        with self.assertLogs('docserve.images', 'WARNING') as logs:
+            stats = optimize_images(self.site_dir, self.cache_dir, formats=['webp'], widths=[400], workers=1)
+        self.assertIn('broken.png', logs.output[0])
+        self.assertEqual(stats, {'images': 2, 'processed': 1, 'cached': 0, 'failed': 1})
+
+        # the good image is still optimised, the broken one untouched and not cached
+        guide = os.path.join(self.site_dir, 'guide')
+        self.assertTrue(os.path.exists(os.path.join(guide, 'shot.png.webp')))
+        self.assertFalse(os.path.exists(os.path.join(guide, 'broken.png.webp')))
+        with open(broken, 'rb') as f:
+            self.assertEqual(f.read(), b'not really a png')
+        entries = [name for root, dirs, names in os.walk(self.cache_dir) for name in dirs if len(name) == 64]
+        self.assertEqual(len(entries), 1)
+        self.assertFalse([name for root, dirs, names in os.walk(self.cache_dir) for name in dirs if name.endswith('.tmp')])
+
+    def test_exif_orientation_applied_and_kept(self):
+        from PIL import Image, ImageOps
+
+        # a noisy photo saved at full quality, so recompressing it replaces the original
+        photo = os.path.join(self.site_dir, 'guide', 'photo.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90 cw to display
+        exif[0x010F] = 'Camera Co'
+        Image.effect_noise((300, 200), 60).convert('RGB').save(photo, 'JPEG', quality=100, exif=exif.tobytes())
+        before = os.path.getsize(photo)
+
+        optimize_images(self.site_dir, self.cache_dir, formats=['webp'], widths=[100], workers=1)
+
+        self.assertLess(os.path.getsize(photo), before)
+        for name in ('photo.jpg', 'photo.jpg.webp', 'photo@100w.jpg'):
+            with Image.open(os.path.join(self.site_dir, 'guide', name)) as im:
+                displayed = ImageOps.exif_transpose(im)
+                # displayed portrait, 2:3, whether or not the orientation tag was applied to the pixels
+                self.assertEqual(displayed.height * 2, displayed.width * 3, name)
+                self.assertEqual(im.getexif().get(0x010F), 'Camera Co', name)
+
+    def test_animated_images_left_alone(self):
+        from PIL import Image
+
+        apng = os.path.join(self.site_dir, 'guide', 'spinner.png')
+        frames = [Image.new('RGB', (800, 400), (i * 50, 0, 0)) for i in range(5)]
+        frames[0].save(apng, save_all=True, append_images=frames[1:], duration=100)
+        with open(apng, 'rb') as f:
+            original = f.read()
+
+        optimize_images(self.site_dir, self.cache_dir, formats=['webp'], widths=[400], workers=1)
+
+        with open(apng, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        with Image.open(apng) as im:
+            self.assertEqual(im.n_frames, 5)
+        guide = os.path.join(self.site_dir, 'guide')
+        self.assertFalse(os.path.exists(os.path.join(guide, 'spinner.png.webp')))
+        self.assertFalse(os.path.exists(os.path.join(guide, 'spinner@400w.png')))
@@ -0,0 +1,142 @@
+# docserve/tests/test_postprocess.py
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+from docserve import postprocess
+from docserve.postprocess import is_fingerprinted, minify_html, postprocess_site
+from docserve.tests.base import DocsSiteTestCase
+
+
+class PostprocessTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site_dir = os.path.join(self.temp_dir, 'user')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, rel, content):
+        path = os.path.join(self.site_dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def read(self, rel):
+        with open(os.path.join(self.site_dir, rel)) as f:
+            return f.read()
+
+    def test_minify_html(self):
+        html = (
+            '<ul>\n    <li>a</li>\n\n    <li>b  c</li>\n</ul>\n<!-- note -->'
+            '<pre><code>  keep\n    this</code></pre>\n  <script>if (a  <  b) {}</script>'
+        )
+        minified, raw = minify_html(html)
+        self.assertEqual(
+            minified,
+            '<ul>\n<li>a</li>\n<li>b c</li>\n</ul>\n<pre><code>  keep\n    this</code></pre>\n<script>if (a  <  b) {}</script>'
+        )
+        self.assertIsNone(raw)
+
+        # a piece ending inside <pre> hands that on to the next piece
+        self.assertEqual(minify_html('<pre>  a', None), ('<pre>  a', 'pre'))
+        self.assertEqual(minify_html('  b</pre>  c', 'pre'), ('  b</pre> c', None))
+
+    def test_fingerprint_and_rewrite(self):
+        self.write('assets/images/logo.png', 'png')
+        self.write('assets/images/logo.png.webp', 'webp')
+        self.write('assets/fonts/icons.woff2', 'font')
+        self.write('assets/stylesheets/extra.css', '@font-face { src: url("../fonts/icons.woff2?v=1"); }')
+        self.write('assets/stylesheets/main.ec1eaa64.min.css', 'body {}')
+        self.write('assets/javascripts/lunr/min/lunr.de.min.js', 'lunr')
+        self.write('guide/assets/logo.png', 'page image')
+        self.write('index.html', '<img src="assets/images/logo.png"><link href="assets/stylesheets/main.ec1eaa64.min.css">')
+        self.write('guide/intro.html',
+                   '<img src="../assets/images/logo.png"> <img src="assets/logo.png">\n'
+                   '<link href="/docs/user/assets/stylesheets/extra.css">')
+
+        stats = postprocess_site(self.site_dir, workers=1, base_url='/docs/user/')
+        self.assertEqual(stats['pages'], 2)
+
+        files = {
+            os.path.relpath(os.path.join(root, name), self.site_dir)
+            for root, dirs, names in os.walk(os.path.join(self.site_dir, 'assets')) for name in names
+        }
+        logo = next(f for f in files if f.startswith('assets/images/logo.') and f.endswith('.png'))
+        self.assertTrue(is_fingerprinted(logo))
+        self.assertIn(logo + '.webp', files)
+        self.assertIn('assets/stylesheets/main.ec1eaa64.min.css', files)
+        self.assertIn('assets/javascripts/lunr/min/lunr.de.min.js', files)
+        font = next(f for f in files if f.startswith('assets/fonts/icons.'))
+        extra = next(f for f in files if f.startswith('assets/stylesheets/extra.'))
+        self.assertTrue(is_fingerprinted(extra))
+
+        self.assertIn(f'url("../fonts/{os.path.basename(font)}?v=1")', self.read(extra))
+        self.assertEqual(
+            self.read('index.html'),
+            f'<img src="{logo}"><link href="assets/stylesheets/main.ec1eaa64.min.css">'
+        )
+        # guide/assets/logo.png is a different file and keeps its name
+        self.assertEqual(
+            self.read('guide/intro.html'),
+            f'<img src="../{logo}"> <img src="assets/logo.png">\n<link href="/docs/user/{extra}">'
+        )
+
+    def test_absolute_urls_only_for_this_role(self):
+        self.write('assets/images/logo.png', 'png')
+        self.write('index.html', '\n'.join([
+            '<img src="https://example.org/docs/user/assets/images/logo.png">',
+            '<img src="//example.org/docs/user/assets/images/logo.png">',
+            '<img src="/docs/user/assets/images/logo.png">',
+            '<img src="https://cdn.other.org/assets/images/logo.png">',
+            '<img src="https://cdn.other.org/docs/user/assets/images/logo.png">',
+            '<img src="/docs/admin/assets/images/logo.png">',
+            '<img src="/docs/user/guide/assets/images/logo.png">',
+        ]))
+        postprocess_site(self.site_dir, minify=False, workers=1, base_url='https://example.org/docs/user/')
+        logo = os.path.basename(next(
+            name for name in os.listdir(os.path.join(self.site_dir, 'assets', 'images')) if is_fingerprinted(name)
+        ))
+        self.assertEqual(self.read('index.html').split('\n'), [
+            f'<img src="https://example.org/docs/user/assets/images/{logo}">',
+            f'<img src="//example.org/docs/user/assets/images/{logo}">',
+            f'<img src="/docs/user/assets/images/{logo}">',
+            '<img src="https://cdn.other.org/assets/images/logo.png">',
+            '<img src="https://cdn.other.org/docs/user/assets/images/logo.png">',
+            '<img src="/docs/admin/assets/images/logo.png">',
+            '<img src="/docs/user/guide/assets/images/logo.png">',
+        ])
+
+        # without the role's url, absolute urls can't be told apart and are left alone
+        self.write('assets/a.png', 'png')
+        self.write('other.html', '<img src="/docs/user/assets/a.png"><img src="assets/a.png">')
+        postprocess_site(self.site_dir, minify=False, workers=1)
+        self.assertRegex(self.read('other.html'), r'^<img src="/docs/user/assets/a\.png"><img src="assets/a\.[0-9a-f]{8}\.png">$')
+
+    def test_pages_are_streamed_in_chunks(self):
+        body = ''.join(f'<p>\n  paragraph {i}\n</p>\n<!-- {i} -->' for i in range(200))
+        self.write('index.html', f'<pre>  x\n  y</pre>{body}<img src="assets/a.png">')
+        self.write('assets/a.png', 'png')
+        with mock.patch.object(postprocess, '_CHUNK', 64):
+            postprocess_site(self.site_dir, workers=1)
+        html = self.read('index.html')
+        self.assertTrue(html.startswith('<pre>  x\n  y</pre><p>\nparagraph 0\n</p>\n<p>'))
+        self.assertNotIn('<!--', html)
+        self.assertIn('<p>\nparagraph 199\n</p>\n', html)
+        self.assertRegex(html, r'<img src="assets/a\.[0-9a-f]{8}\.png">$')
+
+
+class ServeDocsAssetCacheTest(DocsSiteTestCase):
+    def test_only_fingerprinted_assets_are_immutable(self):
+        self.write('assets/main.ec1eaa64.min.css', 'body {}')
+        self.write('assets/extra.css', 'body {}')
+
+        response = self.client.get('/docs/user/assets/main.ec1eaa64.min.css')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get('/docs/user/assets/extra.css')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
@@ -0,0 +1,93 @@
+# docserve/tests/test_profiling.py
+
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from docserve.management.commands.build_docs import Command as BuildDocsCommand
+from docserve.profiling import mkdocs_stage_timings
+
+
+class MkdocsStageTimingsTest(TestCase):
+    def test_stage_timings(self):
+        lines = [
+            (0.0, 'INFO    -  Cleaning site directory'),
+            (0.5, "DEBUG   -  Running `pre_build` event from plugin 'search'"),
+            (0.75, 'DEBUG   -  Reading: index.md'),
+            (1.0, 'DEBUG   -  Building page index.md'),
+            (3.0, 'DEBUG   -  Building page faqs.md'),
+            (4.0, 'INFO    -  Documentation built in 4.00 seconds'),
+        ]
+        self.assertEqual(mkdocs_stage_timings(lines), {
+            'clean': 0.5,
+            'plugin search.on_pre_build': 0.25,
+            'read_pages': 0.25,
+            'build_pages': 3.0,
+            'reported_total': 4.0,
+        })
+
+
+class GenerateMkdocsYmlProfileTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.docs_root = os.path.join(self.temp_dir, 'docs')
+        self.site_root = os.path.join(self.temp_dir, 'docs_site')
+        for role in ('user', 'admin'):
+            os.makedirs(os.path.join(self.docs_root, role))
+            with open(os.path.join(self.docs_root, role, 'index.md'), 'w') as f:
+                f.write('# Index\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_profile_report_and_history(self):
+        with self.settings(DOCSERVE_DOCS_ROOT=self.docs_root, DOCSERVE_DOCS_SITE_ROOT=self.site_root):
+            out = StringIO()
+            call_command('generate_mkdocs_yml', profile=True, stdout=out)
+            call_command('generate_mkdocs_yml', profile=True, stdout=StringIO())
+
+        self.assertIn("Profile written to", out.getvalue())
+        # both runs keep their report, even within the same second
+        self.assertEqual(len(os.listdir(os.path.join(self.site_root, '.docserve', 'profile'))), 2)
+
+        history = os.path.join(self.site_root, '.docserve', 'build_history.jsonl')
+        with open(history) as f:
+            runs = [json.loads(line) for line in f]
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(set(runs[0]['roles']), {'user', 'admin'})
+        record = runs[0]['roles']['user']
+        self.assertEqual(record['md_files'], 1)
+        for key in ('wall', 'cpu', 'nav'):
+            self.assertIn(key, record)
+        # the second run preserves the yml generated by the first
+        self.assertIn('preserve_skipped', runs[1]['roles']['user'])
+
+    def test_failed_build_is_profiled(self):
+        for role in ('user', 'admin'):
+            with open(os.path.join(self.docs_root, f'mkdocs_{role}.yml'), 'w') as f:
+                f.write(f'site_name: {role}\n')
+
+        def run_mkdocs(command, build_command, record=None):
+            if 'mkdocs_admin.yml' in build_command[3]:
+                return 1, '', 'boom'
+            os.makedirs(build_command[5], exist_ok=True)
+            return 0, '', ''
+
+        out = StringIO()
+        with self.settings(DOCSERVE_DOCS_ROOT=self.docs_root, DOCSERVE_DOCS_SITE_ROOT=self.site_root,
+                           DOCSERVE_OPTIMIZE_IMAGES=False), \
+                mock.patch.object(BuildDocsCommand, 'run_mkdocs', run_mkdocs):
+            with self.assertRaises(CommandError):
+                call_command('build_docs', profile=True, stdout=out, stderr=StringIO())
+
+        self.assertIn("Profile written to", out.getvalue())
+        with open(os.path.join(self.site_root, '.docserve', 'build_history.jsonl')) as f:
+            run = json.loads(f.readline())
+        self.assertTrue(run['roles']['admin']['failed'])
+        self.assertIn('mkdocs', run['roles']['admin'])
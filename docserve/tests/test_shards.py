@@ -0,0 +1,96 @@
+# docserve/tests/test_shards.py
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from docserve.shards import ROOT_SHARD, is_sharded, merge_shards, shard_configs, split_nav
+
+
+class ShardsTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.docs_dir = os.path.join(self.temp_dir, 'user')
+        for section in ('guide', 'faq'):
+            os.makedirs(os.path.join(self.docs_dir, section))
+        self.nav = [
+            {'Index': 'index.md'},
+            {'Guide': [{'Intro': 'guide/intro.md'}, {'Setup': 'guide/setup.md'}]},
+            {'Faq': [{'Q1': 'faq/q1.md'}]},
+            {'Mixed': [{'A': 'guide/a.md'}, {'B': 'faq/b.md'}]},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, rel, content):
+        path = os.path.join(self.temp_dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_is_sharded(self):
+        self.assertTrue(is_sharded('user', ['user']))
+        self.assertTrue(is_sharded('user', '__all__'))
+        self.assertFalse(is_sharded('user', []))
+        self.assertFalse(is_sharded('user', None))
+
+    def test_split_nav(self):
+        shards = [shard for shard, _ in split_nav(self.nav, self.docs_dir)]
+        # sections spanning directories stay in the root shard
+        self.assertEqual(shards, [ROOT_SHARD, 'guide', 'faq', ROOT_SHARD])
+
+    def test_shard_configs(self):
+        config = {'site_name': 'User', 'nav': self.nav, 'exclude_docs': 'drafts/\n'}
+        configs = shard_configs(config, self.docs_dir, '/docs/user/')
+        self.assertEqual(sorted(configs), [ROOT_SHARD, 'faq', 'guide'])
+
+        guide = configs['guide']
+        self.assertEqual(guide['site_name'], 'User')
+        self.assertEqual(guide['nav'][1], self.nav[1])
+        self.assertEqual(guide['nav'][0], {'Index': '/docs/user/index.html'})
+        self.assertEqual(guide['nav'][2], {'Faq': '/docs/user/faq/q1.html'})
+        self.assertEqual(guide['exclude_docs'], 'drafts/\n/*\n!/guide/\n')
+
+        self.assertEqual(configs[ROOT_SHARD]['exclude_docs'], 'drafts/\n/guide/\n/faq/\n')
+        # the full config is left untouched
+        self.assertEqual(config['nav'], self.nav)
+
+    def test_shard_configs_without_sections(self):
+        self.assertEqual(shard_configs({'nav': [{'Index': 'index.md'}]}, self.docs_dir, '/docs/user/'), {})
+
+    def test_merge_shards(self):
+        search = lambda *locations: json.dumps({'config': {}, 'docs': [{'location': loc} for loc in locations]})
+        sitemap = lambda *urls: ''.join(f'<url><loc>{url}</loc></url>' for url in urls)
+
+        self.write('root/index.html', 'root index')
+        self.write('root/guide/intro.html', 'stale guide page from the root shard')
+        self.write('root/search/search_index.json', search('index.html'))
+        self.write('root/sitemap.xml', sitemap('http://x/index.html'))
+        self.write('guide/guide/intro.html', 'guide intro')
+        self.write('guide/index.html', 'guide copy of the root index')
+        self.write('guide/search/search_index.json', search('index.html', 'guide/intro.html'))
+        self.write('guide/sitemap.xml', sitemap('http://x/guide/intro.html'))
+        dest = os.path.join(self.temp_dir, 'site')
+        self.write('site/old.html', 'from the previous build')
+
+        merge_shards({ROOT_SHARD: os.path.join(self.temp_dir, 'root'), 'guide': os.path.join(self.temp_dir, 'guide')}, dest)
+
+        with open(os.path.join(dest, 'index.html')) as f:
+            self.assertEqual(f.read(), 'root index')
+        with open(os.path.join(dest, 'guide', 'intro.html')) as f:
+            self.assertEqual(f.read(), 'guide intro')
+        self.assertFalse(os.path.exists(os.path.join(dest, 'old.html')))
+
+        with open(os.path.join(dest, 'search', 'search_index.json')) as f:
+            locations = [doc['location'] for doc in json.load(f)['docs']]
+        self.assertEqual(locations, ['index.html', 'guide/intro.html'])
+
+        with open(os.path.join(dest, 'sitemap.xml')) as f:
+            content = f.read()
+        self.assertIn('http://x/index.html', content)
+        self.assertIn('http://x/guide/intro.html', content)
+        self.assertTrue(os.path.exists(os.path.join(dest, 'sitemap.xml.gz')))
@@ -0,0 +1,101 @@
+# docserve/tests/test_signing.py
+
+import time
+
+from django.test import TestCase
+
+from docserve.signing import TOKEN_NAME, SignedDocsMiddleware, make_token, token_expiry
+from docserve.tests.base import DocsSiteTestCase
+
+
+class TokenTest(TestCase):
+    def test_token_scope_and_expiry(self):
+        token = make_token('key', '/docs/user/', time.time() + 60)
+        self.assertTrue(token_expiry('key', token, '/docs/user/guide/intro.html'))
+        self.assertIsNone(token_expiry('key', token, '/docs/admin/index.html'))
+        self.assertIsNone(token_expiry('key', token, '/docs/user/../admin/index.html'))
+        self.assertIsNone(token_expiry('other key', token, '/docs/user/index.html'))
+
+        expired = make_token('key', '/docs/user/', time.time() - 1)
+        self.assertIsNone(token_expiry('key', expired, '/docs/user/index.html'))
+
+        expires, prefix, signature = token.split('.')
+        self.assertIsNone(token_expiry('key', f"{int(expires) + 3600}.{prefix}.{signature}", '/docs/user/index.html'))
+        self.assertIsNone(token_expiry('key', 'nonsense', '/docs/user/index.html'))
+
+    def test_wsgi_middleware(self):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return [b'static']
+
+        def fallback(environ, start_response):
+            start_response('200 OK', [])
+            return [b'django']
+
+        def call(middleware, path, query='', cookie=''):
+            statuses = []
+            body = middleware({'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_COOKIE': cookie},
+                              lambda status, headers: statuses.append(status))
+            return statuses[0], b''.join(body)
+
+        token = make_token('key', '/docs/user/', time.time() + 60)
+        middleware = SignedDocsMiddleware(app, 'key')
+        self.assertEqual(call(middleware, '/docs/user/index.html', cookie=f'{TOKEN_NAME}={token}'), ('200 OK', b'static'))
+        self.assertEqual(call(middleware, '/docs/user/index.html', query=f'{TOKEN_NAME}={token}'), ('200 OK', b'static'))
+        self.assertEqual(call(middleware, '/docs/admin/index.html', cookie=f'{TOKEN_NAME}={token}')[0], '403 Forbidden')
+        self.assertEqual(call(middleware, '/static/site.css'), ('200 OK', b'static'))
+
+        middleware = SignedDocsMiddleware(app, 'key', fallback=fallback)
+        self.assertEqual(call(middleware, '/docs/user/index.html'), ('200 OK', b'django'))
+
+
+class SignedAccessViewsTest(DocsSiteTestCase):
+    settings_overrides = {
+        **DocsSiteTestCase.settings_overrides,
+        'DOCSERVE_SIGNED_ACCESS': True,
+        'DOCSERVE_SIGNING_KEY': 'key',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.html', '<h1>Home</h1>')
+
+    def test_serve_docs_issues_cookie(self):
+        response = self.client.get('/docs/user/')
+        cookie = response.cookies[TOKEN_NAME]
+        self.assertEqual(cookie['path'], '/docs/user/')
+        self.assertTrue(cookie['httponly'])
+        self.assertTrue(token_expiry('key', cookie.value, '/docs/user/guide/intro.html'))
+
+        # not reissued while the browser's token is still fresh
+        self.assertNotIn(TOKEN_NAME, self.client.get('/docs/user/').cookies)
+
+        self.assertNotIn(TOKEN_NAME, self.client.get('/docs/admin/').cookies)
+
+    def test_no_cookie_for_default_role_fallback(self):
+        self.write('index.html', '<h1>Public</h1>', role='public')
+        with self.settings(DOCSERVE_ROLE_DEFINITIONS={'public': lambda user: True}, DOCSERVE_ROLE_DEFAULT='public'):
+            response = self.client.get('/docs/staff/')
+        # served public's docs, but must not sign /docs/staff/ for the static server
+        self.assertEqual(response.content, b'<h1>Public</h1>')
+        self.assertNotIn(TOKEN_NAME, response.cookies)
+
+    def test_no_cookie_for_override_dirs(self):
+        self.write('extra.html', 'x', role='overrides')
+        response = self.client.get('/docs/overrides/extra.html')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(TOKEN_NAME, response.cookies)
+
+    def test_auth_request_endpoint(self):
+        token = make_token('key', '/docs/user/', time.time() + 60)
+        self.client.logout()
+
+        response = self.client.get('/docs/_auth/', HTTP_X_ORIGINAL_URI='/docs/user/index.html',
+                                   HTTP_COOKIE=f'{TOKEN_NAME}={token}')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get('/docs/_auth/', HTTP_X_ORIGINAL_URI=f'/docs/user/guide%20one/a.png?{TOKEN_NAME}={token}')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get('/docs/_auth/', HTTP_X_ORIGINAL_URI='/docs/admin/index.html',
+                                   HTTP_COOKIE=f'{TOKEN_NAME}={token}')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get('/docs/_auth/', HTTP_X_ORIGINAL_URI='/docs/user/index.html').status_code, 401)
@@ -0,0 +1,69 @@
+# docserve/tests/test_views.py
+
+import os
+import shutil
+
+from docserve.cache import build_version, write_build_version
+from docserve.tests.base import DocsSiteTestCase
+
+
+class ServeDocsCacheTest(DocsSiteTestCase):
+    settings_overrides = {
+        **DocsSiteTestCase.settings_overrides,
+        'DOCSERVE_CACHE': 'docserve',
+        'CACHES': {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'docserve': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'docserve-tests'},
+        },
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.html', '<h1>Home</h1>')
+        self.write('guide/intro.html', '<h1>Intro</h1>')
+        write_build_version(self.temp_dir)
+
+    def test_cached_until_rebuilt(self):
+        response = self.client.get('/docs/user/guide/intro')
+        self.assertEqual(response.content, b'<h1>Intro</h1>')
+
+        # served from the cache while the build version is unchanged
+        self.write('guide/intro.html', '<h1>Changed</h1>')
+        self.assertEqual(self.client.get('/docs/user/guide/intro').content, b'<h1>Intro</h1>')
+
+        version = build_version(self.temp_dir)
+        self.assertNotEqual(write_build_version(self.temp_dir), version)
+        self.assertEqual(self.client.get('/docs/user/guide/intro').content, b'<h1>Changed</h1>')
+
+    def test_build_version_follows_content(self):
+        # another node building the same docs gets the same version, so shares cache keys
+        other_root = os.path.join(self.temp_dir, 'other_node')
+        shutil.copytree(self.site_dir, os.path.join(other_root, 'user'))
+        self.assertEqual(write_build_version(other_root), build_version(self.temp_dir))
+
+        self.write('index.html', '<h1>New Home</h1>')
+        self.assertNotEqual(write_build_version(self.temp_dir, 'user'), build_version(other_root))
+
+    def test_role_check_not_cached(self):
+        self.assertEqual(self.client.get('/docs/user/').status_code, 200)
+        self.assertEqual(self.client.get('/docs/admin/').status_code, 403)
+
+    def test_missing_and_redirect(self):
+        self.assertEqual(self.client.get('/docs/user/nope').status_code, 404)
+        self.assertEqual(self.client.get('/docs/user/nope').status_code, 404)
+        response = self.client.get('/docs/user/guide/intro/')
+        self.assertRedirects(response, '/docs/user/guide/intro', fetch_redirect_response=False)
+
+    def test_image_format_negotiation(self):
+        self.write('guide/shot.png', b'png')
+        self.write('guide/shot.png.webp', b'webp')
+
+        response = self.client.get('/docs/user/guide/shot.png', HTTP_ACCEPT='image/webp,*/*')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(b''.join(response.streaming_content), b'webp')
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.client.get('/docs/user/guide/shot.png', HTTP_ACCEPT='*/*')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(b''.join(response.streaming_content), b'png')
+        self.assertIn('Accept', response['Vary'])
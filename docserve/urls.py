@@ -7,7 +7,9 @@ app_name = 'docserve'
 
 urlpatterns = [
     path('', views.docs_home, name='docs_home'),
+    path('_auth/', views.docs_auth, name='docs_auth'),
     path('<str:role>/assets/<path:path>', views.serve_docs_asset, name='serve_docs_asset'),
+    path('<str:role>/_fragments/', views.docs_fragments, name='docs_fragments'),
 
     path('<str:role>/', views.serve_docs, name='serve_docs_index'),
     path('<str:role>/<path:path>', views.serve_docs, name='serve_docs'),
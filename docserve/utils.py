@@ -0,0 +1,63 @@
+# docserve/utils.py
+import json
+import os
+from urllib.parse import urlparse
+
+from django.conf import settings
+from ruamel.yaml import YAML
+
+# build metadata (fragments, caches) is kept under the site root, outside the served role directories
+META_DIR = '.docserve'
+
+
+def site_root() -> str:
+    return str(getattr(settings, 'DOCSERVE_DOCS_SITE_ROOT', os.path.join(settings.BASE_DIR, 'docs_site')))
+
+
+def meta_dir(root: str = None) -> str:
+    return os.path.join(root or site_root(), META_DIR)
+
+
+def role_url(role: str) -> str:
+    """
+    The URL prefix a role's docs are served under, eg. /docs/user/.
+    """
+    from django.urls import reverse
+    return reverse('docserve:serve_docs_index', args=[role])
+
+
+def site_url_prefix(site_url: str, role: str) -> str:
+    """
+    The URL path in a role's mkdocs site_url, eg. https://example.org/docs/user/
+    -> /docs/user/. Defaults to /docs/{role}/.
+    """
+    prefix = urlparse(str(site_url or f'/docs/{role}/')).path
+    if not prefix.endswith('/'):
+        prefix += '/'
+    return prefix
+
+
+def configured_site_url(docs_root: str, role: str) -> str:
+    """
+    The site_url of mkdocs_{role}.yml, which build time stages use as the role's
+    URL so they don't depend on the project's URLconf. Falls back to /docs/{role}/.
+    """
+    try:
+        with open(os.path.join(docs_root, f'mkdocs_{role}.yml'), 'r', encoding='utf-8') as f:
+            # round-trip loader, as the file may carry !!python/name tags safe_load rejects
+            config = YAML().load(f) or {}
+    except FileNotFoundError:
+        config = {}
+    return str(config.get('site_url') or f'/docs/{role}/')
+
+
+def write_json_atomic(path: str, data, **kwargs) -> None:
+    """
+    Write json to a temporary file beside path and swap it in, so readers in other
+    processes never see a half-written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp, path)
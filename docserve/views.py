@@ -1,15 +1,22 @@
 # docserve/views.py
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseForbidden, Http404, FileResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404, FileResponse, JsonResponse
 from django.shortcuts import render
 from django.conf import settings
 import os
+import hashlib
 import mimetypes
 from pathlib import Path
 from django.views.static import serve as static_serve
 
 import logging
-from django.utils.cache import patch_cache_control
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .cache import cached
+from .fragments import load_fragment, normalise_page
+from .images import VARIANT_CONTENT_TYPES, accepted_variant, image_variants
+from .postprocess import is_fingerprinted
+from .signing import set_access_cookie, signed_access_enabled, verify_uri
 
 logger = logging.getLogger(__name__)
 
@@ -18,8 +25,16 @@ logger = logging.getLogger(__name__)
 def serve_docs_asset(request, role, path):
     # assets are in the built site directory
     document_root = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role, "assets")
-    resp = static_serve(request, path, document_root=document_root)
-    patch_cache_control(resp, public=True, max_age=31536000, immutable=True)
+    variants = image_variants(os.path.join(document_root, path))
+    variant = accepted_variant(request, variants)
+    resp = static_serve(request, f"{path}.{variant}" if variant else path, document_root=document_root)
+    if variants:
+        patch_vary_headers(resp, ['Accept'])
+    if is_fingerprinted(path):
+        # the name changes with the content (see build_docs), so it can be cached for good
+        patch_cache_control(resp, public=True, max_age=31536000, immutable=True)
+    else:
+        patch_cache_control(resp, public=True, no_cache=True)
     return resp
 
 @login_required
@@ -33,10 +48,10 @@ def docs_home(request):
 
     docs_root = getattr(settings, 'DOCSERVE_DOCS_ROOT', os.path.join(settings.BASE_DIR, 'docs'))
 
-    roles = [
+    roles = cached('_home', 'roles', (str(docs_root), list(ignore)), lambda: [
         d for d in os.listdir(docs_root)
         if os.path.isdir(os.path.join(docs_root, d)) and d not in ignore
-    ]
+    ])
 
     for role in roles:
         role_check = role_definitions.get(role, role_default)
@@ -45,29 +60,108 @@ def docs_home(request):
 
     return render(request, 'docserve/docs_home.html', {'roles': available_roles})
 
+def check_role(request, role):
+    """
+    Check the user has access to a role's docs. Returns (role, forbidden_response):
+    the role may be swapped for DOCSERVE_ROLE_DEFAULT if it is not defined, and
+    forbidden_response is None when access is allowed.
+    """
+    # does this still apply?  trying to load css but role is still a role
+    # allow a directories to bypass role checks, eg. have an overrides directory for custom css and js
+    overrides = getattr(settings, 'DOCSERVE_OVERRIDE_DIRS', ['overrides'])
+    if role in overrides:
+        return role, None
+
+    # check this user has the role required by the first part of the path, eg. docs/role/getting-started/first/page.html
+    role_definitions = getattr(settings, 'DOCSERVE_ROLE_DEFINITIONS', {})
+    role_default = getattr(settings, 'DOCSERVE_ROLE_DEFAULT', None)
+    if not role in role_definitions:
+        if role_default:
+            logger.error(f"Role '{role}' not defined in DOCSERVE_ROLE_DEFINITIONS. Using default role {role_default}.")
+            role = role_default
+        else:
+            return role, HttpResponseForbidden(f"Your role {role} has not been defined so we cannot give you access.")
+
+    role_check = role_definitions.get(role)
+
+    if not role_check(request.user):
+        return role, HttpResponseForbidden("You do not have access to this documentation.")
+
+    return role, None
+
 @login_required
-def serve_docs(request, role, path=''):
-    '''serve the documentation and associated files'''
-    from django.shortcuts import redirect
+def docs_fragments(request, role):
+    """
+    Return the article html, title and table of contents of one or more pages as
+    JSON, eg. /docs/<role>/_fragments/?page=guide/add_entry&page=faqs
+    Fragments are extracted by build_docs; the response carries an ETag so clients
+    can revalidate cheaply.
+    """
+    role, forbidden = check_role(request, role)
+    if forbidden:
+        return forbidden
 
-    original_path = path
-    # remove trailing slash if it is there
-    has_trailing_slash = path.endswith('/')
-    if has_trailing_slash:
-        path = path[:-1]
+    requested = request.GET.getlist('page') or ['']
+    max_batch = getattr(settings, 'DOCSERVE_FRAGMENTS_MAX_BATCH', 20)
+    if len(requested) > max_batch:
+        return HttpResponseBadRequest(f"Too many pages requested, the maximum is {max_batch}.")
+
+    pages = {}
+    missing = []
+    for page in requested:
+        normalised = normalise_page(page)
+        fragment = cached(role, 'fragment', (normalised,), lambda: load_fragment(role, normalised)) if normalised else None
+        if fragment is None:
+            missing.append(page)
+        else:
+            pages[page] = fragment
+
+    if not pages:
+        raise Http404(f"No fragments found for: {', '.join(requested)}")
+
+    etag = '"%s"' % hashlib.sha1(
+        ' '.join(f"{page}={pages[page]['etag']}" for page in sorted(pages)).encode('utf-8')
+    ).hexdigest()
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({'role': role, 'pages': pages, 'missing': missing})
+    response.headers['ETag'] = etag
+    # role-protected, so never shared, but always revalidated against the ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def docs_auth(request):
+    """
+    nginx auth_request endpoint for DOCSERVE_SIGNED_ACCESS: 204 if the original
+    request (X-Original-URI) carries a valid token for its path, otherwise 401.
+    Only checks the token signature, so it never touches the database or session.
+    """
+    uri = request.META.get('HTTP_X_ORIGINAL_URI', '')
+    if signed_access_enabled() and uri and verify_uri(uri, request.META.get('HTTP_COOKIE', '')):
+        return HttpResponse(status=204)
+    return HttpResponse(status=401)
+
+def _find_static_file(role, path):
+    """
+    Look for a file that can be served before the role check (assets, relative links
+    that went wrong, js/css/png). Returns (path relative to the site root, content type,
+    available image variants) or None.
+    """
+    site_root = settings.DOCSERVE_DOCS_SITE_ROOT
 
     # if assets/ is in the path, it might be a nested request for a global asset
     if 'assets/' in path:
         # extract the path from assets/ onwards
         asset_path = path[path.find('assets/'):]
-        full_path = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role, asset_path)
+        full_path = os.path.join(site_root, role, asset_path)
         if os.path.exists(full_path) and os.path.isfile(full_path):
             content_type, _ = mimetypes.guess_type(full_path)
             if not content_type:
                 if full_path.endswith('.css'): content_type = 'text/css'
                 elif full_path.endswith('.js'): content_type = 'text/javascript'
                 else: content_type = 'application/octet-stream'
-            return FileResponse(open(full_path, "rb"), content_type=content_type)
+            return os.path.join(role, asset_path), content_type, image_variants(full_path)
 
     # if there is an extension and it's not found at the original path, 
     # it might be a relative link that went wrong. Try to find it by stripping path components.
@@ -76,59 +170,29 @@ def serve_docs(request, role, path=''):
         temp_path = path
         while '/' in temp_path:
             temp_path = temp_path.split('/', 1)[1]
-            full_path = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role, temp_path)
+            full_path = os.path.join(site_root, role, temp_path)
             if os.path.exists(full_path) and os.path.isfile(full_path):
                 content_type, _ = mimetypes.guess_type(full_path)
                 logger.info(f"Serving {full_path} as fallback for {original_path}")
-                return FileResponse(open(full_path, "rb"), content_type=content_type or 'application/octet-stream')
+                return os.path.join(role, temp_path), content_type or 'application/octet-stream', image_variants(full_path)
 
     # if extensions are min.js or min.css then just serve them directly
-    if path.endswith('.js'):
-        content_type = 'text/javascript'
-        full_path = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role, path)
-        if os.path.exists(full_path) and os.path.isfile(full_path):
-            return FileResponse(open(full_path, "rb"), content_type=content_type)
-        else:
-            logger.warning(f"File does NOT exist: {full_path}")
-
-    if path.endswith('.css'):
-        content_type = 'text/css'
-        full_path = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role, path)
-        if os.path.exists(full_path) and os.path.isfile(full_path):
-            return FileResponse(open(full_path, "rb"), content_type=content_type)
-        else:
-            logger.warning(f"File does NOT exist: {full_path}")
-
-    if path.endswith('.png'):
-        content_type = 'image/png'
-        full_path = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role, path)
-        if os.path.exists(full_path) and os.path.isfile(full_path):
-            return FileResponse(open(full_path, "rb"), content_type=content_type)
-        else:
-            logger.warning(f"File does NOT exist: {full_path}")
-
-    # does this still apply?  trying to load css but role is still a role
-    # allow a directories to bypass role checks, eg. have an overrides directory for custom css and js
-    overrides = getattr(settings, 'DOCSERVE_OVERRIDE_DIRS', ['overrides'])
-    if not role in overrides:
-
-        # check this user has the role required by the first part of the path, eg. docs/role/getting-started/first/page.html
-        role_definitions = getattr(settings, 'DOCSERVE_ROLE_DEFINITIONS', {})
-        role_default = getattr(settings, 'DOCSERVE_ROLE_DEFAULT', None)
-        if not role in role_definitions:
-            if role_default:
-                logger.error(f"Role '{role}' not defined in DOCSERVE_ROLE_DEFINITIONS. Using default role {role_default}.")
-                role = role_default
+    for extension, content_type in (('.js', 'text/javascript'), ('.css', 'text/css'), ('.png', 'image/png')):
+        if path.endswith(extension):
+            full_path = os.path.join(site_root, role, path)
+            if os.path.exists(full_path) and os.path.isfile(full_path):
+                return os.path.join(role, path), content_type, image_variants(full_path)
             else:
-                return HttpResponseForbidden(f"Your role {role} has not been defined so we cannot give you access.")
-
-        role_check = role_definitions.get(role)
+                logger.warning(f"File does NOT exist: {full_path}")
 
-        if not role_check(request.user):
-            return HttpResponseForbidden("You do not have access to this documentation.")
-
-    docs_root = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role)
+    return None
 
+def _resolve_page(docs_root, path, has_trailing_slash):
+    """
+    Map a requested path to the built file to serve. Returns {'redirect': True} if the
+    request should drop its trailing slash, otherwise the file's path relative to
+    docs_root, whether it exists, its size and content type.
+    """
     if path == '':
         # Serve the documentation home page
         path = 'index.html'
@@ -153,20 +217,92 @@ def serve_docs(request, role, path=''):
         # as the browser SHOULD have a trailing slash for directories usually, 
         # but MkDocs with use_directory_urls: False (which we set) prefers file.html
         if path.endswith('.html') and not path.endswith('index.html'):
-             # Redirect to the same URL but without the trailing slash
-             return redirect(request.path[:-1])
+            return {'redirect': True}
 
     file_path = os.path.join(docs_root, path)
-
     if not os.path.exists(file_path):
-        raise Http404(f"Page not found: {path}")
+        return {'path': path, 'exists': False}
+
+    content_type, _ = mimetypes.guess_type(file_path)
+    variants = {}
+    for variant in image_variants(file_path):
+        variants[variant] = os.path.getsize(f"{file_path}.{variant}")
+    return {
+        'path': path,
+        'exists': True,
+        'size': os.path.getsize(file_path),
+        'content_type': content_type or 'application/octet-stream',
+        'variants': variants,
+    }
 
+def _read_file(file_path):
     with open(file_path, 'rb') as f:
-        content = f.read()
+        return f.read()
 
-    content_type, _ = mimetypes.guess_type(file_path)
+@login_required
+def serve_docs(request, role, path=''):
+    '''serve the documentation and associated files'''
+    from django.shortcuts import redirect
+
+    # remove trailing slash if it is there
+    has_trailing_slash = path.endswith('/')
+    if has_trailing_slash:
+        path = path[:-1]
+
+    # resolved lookups (not role checks) go through the shared cache if DOCSERVE_CACHE is set
+    static_file = cached(role, 'static', (path,), lambda: _find_static_file(role, path))
+    if static_file:
+        rel_path, content_type, variants = static_file
+        full_path = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, rel_path)
+        variant = accepted_variant(request, variants)
+        if variant:
+            full_path = f"{full_path}.{variant}"
+            content_type = VARIANT_CONTENT_TYPES[variant]
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+        if variants:
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    url_role = role
+    role, forbidden = check_role(request, role)
+    if forbidden:
+        return forbidden
+
+    docs_root = os.path.join(settings.DOCSERVE_DOCS_SITE_ROOT, role)
+
+    resolved = cached(role, 'page', (path, has_trailing_slash),
+                      lambda: _resolve_page(docs_root, path, has_trailing_slash))
+    if resolved.get('redirect'):
+        # Redirect to the same URL but without the trailing slash
+        return redirect(request.path[:-1])
+
+    if not resolved['exists']:
+        raise Http404(f"Page not found: {resolved['path']}")
+
+    rel_path = resolved['path']
+    content_type = resolved['content_type']
+    size = resolved['size']
+    variant = accepted_variant(request, list(resolved['variants']))
+    if variant:
+        rel_path = f"{rel_path}.{variant}"
+        content_type = VARIANT_CONTENT_TYPES[variant]
+        size = resolved['variants'][variant]
+
+    file_path = os.path.join(docs_root, rel_path)
     logger.info(f"Serving {file_path} with content type {content_type}")
-    if not content_type:
-        content_type = 'application/octet-stream'
 
-    return HttpResponse(content, content_type=content_type)
+    if size <= getattr(settings, 'DOCSERVE_CACHE_MAX_BYTES', 256 * 1024):
+        content = cached(role, 'body', (rel_path,), lambda: _read_file(file_path))
+    else:
+        content = _read_file(file_path)
+
+    response = HttpResponse(content, content_type=content_type)
+    if resolved['variants']:
+        patch_vary_headers(response, ['Accept'])
+    # let a static server or CDN in front deliver the rest of this role's docs. Only when
+    # the role in the url is the one that was checked: a token for an undefined role served
+    # via DOCSERVE_ROLE_DEFAULT would let the static server hand out that role's directory
+    overrides = getattr(settings, 'DOCSERVE_OVERRIDE_DIRS', ['overrides'])
+    if signed_access_enabled() and role == url_role and role not in overrides:
+        set_access_cookie(request, response, role)
+    return response